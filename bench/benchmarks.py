@@ -0,0 +1,249 @@
+"""Benchmarks of the pure-Python hot paths. Each benchmark sets up its inputs and returns the
+callable that is timed. Inputs are seeded, so results are comparable between commits."""
+import math
+import random
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pcbnew
+from pcbnew import FromMM, wxPoint
+
+from coil import Coil, CoilStyle, evaluate_coils
+import path_finder
+import utils
+import vector
+
+BENCHMARKS: Dict[str, Callable[[], Callable[[], None]]] = {}
+# A station grid of 252 x 60 mm at 0.2 mm per cell
+STATION_GRID = (1260, 300)
+
+def benchmark(name: str):
+    def register(setup: Callable[[], Callable[[], None]]):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+# ==================== Obstacle maps ====================
+def add_station_walls(graph: path_finder.Graph, seed: int = 0) -> None:
+    """Stamps pad rows like the mux and mcu headers, spacers and scattered obstacles"""
+    rng = random.Random(seed)
+    (w, h) = (graph.width, graph.height)
+    for x0 in range(w // 8, w, w // 4):
+        for i in range(12):
+            graph.add_wall_pad((x0 + 8 * i, h // 2, 5, True))
+            graph.add_wall_pad((x0 + 8 * i, h // 2 + 40, 5, False))
+    for _ in range(8):
+        (x, y) = (rng.randrange(w - 60), rng.randrange(h - 60))
+        graph.add_wall_rect(x, x + 60, y, y + rng.randrange(60))
+    for _ in range(200):
+        graph.add_wall_oct(rng.randrange(w), rng.randrange(h), 9)
+
+
+def load_map(path: str) -> path_finder.Graph:
+    """Returns a graph with the walls recorded by `path_finder.save_heatmap` in an NPZ file"""
+    walls = np.load(path)['walls']
+    (depth, width, height) = walls.shape
+    graph = path_finder.Graph(width, height, depth)
+    graph.wall_count[:] = walls.reshape(depth * width, height)
+    graph.walls[:] = graph.wall_count > 0
+    return graph
+
+
+def free_cells(graph: path_finder.Graph, n: int, seed: int = 0) -> List[int]:
+    rng = random.Random(seed)
+    cells = []
+    while len(cells) < n:
+        cell = graph.index(rng.randrange(graph.width), rng.randrange(graph.height))
+        if not graph.is_wall[cell]:
+            cells.append(cell)
+    return cells
+
+
+def get_net_pairs(graph: path_finder.Graph, n: int, min_distance: int, seed: int = 0) -> List[Tuple[int, int]]:
+    """Returns `n` seeded pairs of free cells at least `min_distance` apart"""
+    cells = free_cells(graph, 20 * n, seed)
+    pairs = []
+    for src, dst in zip(cells[::2], cells[1::2]):
+        (x1, y1), (x2, y2) = graph.coords(src), graph.coords(dst)
+        if abs(x1 - x2) + abs(y1 - y2) >= min_distance:
+            pairs.append((src, dst))
+        if len(pairs) == n:
+            break
+    return pairs
+
+
+def find_paths_on(graph: path_finder.Graph, engine: str, margin: int = 40, coarse: int = None) -> Callable[[], None]:
+    pairs = get_net_pairs(graph, 4, graph.width // 8)
+
+    def run() -> None:
+        for src, dst in pairs:
+            graph.reset_nodes()
+            path_finder.find_path(graph, src, dst, margin, engine, coarse)
+    return run
+
+
+# ==================== path_finder ====================
+@benchmark('graph_init')
+def bench_graph_init():
+    return lambda: path_finder.Graph(*STATION_GRID)
+
+
+@benchmark('graph_stamp_walls')
+def bench_graph_stamp_walls():
+    graph = path_finder.Graph(*STATION_GRID)
+
+    def run() -> None:
+        with graph.wall_layer('bench'):
+            add_station_walls(graph)
+        graph.remove_wall_layer('bench')
+    return run
+
+
+@benchmark('graph_stamp_path')
+def bench_graph_stamp_path():
+    graph = path_finder.Graph(*STATION_GRID)
+    (w, h) = STATION_GRID
+    path = [graph.index(x, h // 4 + (x // 3) % (h // 2)) for x in range(w)]
+
+    def run() -> None:
+        with graph.wall_layer('bench'):
+            graph.add_wall_path(path, 10, 10)
+        graph.remove_wall_layer('bench')
+    return run
+
+
+def _register_find_path(engine: str, coarse: int = None) -> None:
+    name = f'find_path_{engine}' + ('_coarse' if coarse else '')
+
+    @benchmark(name)
+    def setup():
+        graph = path_finder.Graph(*STATION_GRID)
+        add_station_walls(graph)
+        return find_paths_on(graph, engine, coarse=coarse)
+
+
+for _engine in ('astar', 'jps', 'bidirectional'):
+    _register_find_path(_engine)
+_register_find_path('astar', 5)
+
+
+# ==================== vector ====================
+def zigzag(n: int, seed: int = 0) -> List[wxPoint]:
+    rng = random.Random(seed)
+    points = [wxPoint(0, 0)]
+    for i in range(n - 1):
+        step = FromMM(rng.uniform(1, 10))
+        points.append(points[-1] + (wxPoint(step, 0) if i % 2 else wxPoint(step, step)))
+    return points
+
+
+@benchmark('vector_offset')
+def bench_vector_offset():
+    path = zigzag(50)
+    return lambda: vector.offset([vector.copy(p) for p in path], FromMM(1))
+
+
+@benchmark('vector_intersection')
+def bench_vector_intersection():
+    rng = random.Random(0)
+    segments = [(wxPoint(rng.randrange(10 ** 7), rng.randrange(10 ** 7)), wxPoint(rng.randrange(10 ** 7), rng.randrange(10 ** 7))) for _ in range(1000)]
+    pairs = list(zip(segments, segments[1:]))
+
+    def run() -> None:
+        for (a, b), (c, d) in pairs:
+            vector.intersection(a, b, c, d)
+    return run
+
+
+# ==================== coil ====================
+@benchmark('coil_style')
+def bench_coil_style():
+    return lambda: CoilStyle(FromMM(20), FromMM(0.8), FromMM(0.6))
+
+
+@benchmark('evaluate_coils')
+def bench_evaluate_coils():
+    (diameter, track_w, track_s) = np.meshgrid(np.linspace(FromMM(10), FromMM(80), 40), np.linspace(FromMM(0.2), FromMM(2), 16), np.linspace(FromMM(0.2), FromMM(2), 16))
+    return lambda: evaluate_coils(diameter, track_w, track_s)
+
+
+@benchmark('coil_init_points')
+def bench_coil_init_points():
+    style = CoilStyle(FromMM(20), FromMM(0.8), FromMM(0.6))
+
+    def run() -> None:
+        coil = Coil(None, style, wxPoint(FromMM(30), FromMM(-10)), math.radians(90), True)
+        (coil.get_terminal(), coil.spiral)
+    return run
+
+
+# ==================== utils ====================
+def draw_station(board, seed: int = 0) -> None:
+    """Draws the coils of a 16-layer station and seeded traces crossing the fold lines on a board or builder"""
+    rng = random.Random(seed)
+    style = CoilStyle(FromMM(20), FromMM(0.8), FromMM(0.6))
+    length = FromMM(63)
+    for i in range(4):
+        for j in range(4):
+            Coil(board, style, wxPoint(i * length + (j + 0.5) * length // 5, -length // 10), math.radians(90), True).create()
+    for _ in range(40):
+        x = rng.randrange(4 * length)
+        utils.polyline(board, [wxPoint(x, -FromMM(5)), wxPoint(x + FromMM(3), FromMM(5)), wxPoint(x + FromMM(3), FromMM(60))], FromMM(0.4), pcbnew.F_Cu)
+
+
+def station_board(seed: int = 0) -> pcbnew.BOARD:
+    board = pcbnew.BOARD()
+    draw_station(board, seed)
+    return board
+
+
+@benchmark('fold_line')
+def bench_fold_line():
+    board = station_board()
+    drawings = list(board.GetDrawings())
+    (diameter, distance, width, clearance) = (FromMM(0.6), FromMM(1), FromMM(0.2), FromMM(0.075))
+
+    def run() -> None:
+        board.drawings = list(drawings)
+        utils.fold_line(board, wxPoint(0, 0), wxPoint(FromMM(252), 0), diameter, distance, width, clearance)
+    return run
+
+
+@benchmark('hit_something')
+def bench_hit_something():
+    board = station_board()
+    rng = random.Random(0)
+    points = [wxPoint(rng.randrange(FromMM(252)), rng.randrange(-FromMM(20), FromMM(20))) for _ in range(100)]
+
+    def run() -> None:
+        for p in points:
+            utils.hit_something(board, p, FromMM(0.6), FromMM(0.075))
+    return run
+
+
+@benchmark('segment_index')
+def bench_segment_index():
+    board = station_board()
+    return lambda: utils.SegmentIndex(board)
+
+
+@benchmark('hit_something_indexed')
+def bench_hit_something_indexed():
+    index = utils.SegmentIndex(station_board())
+    rng = random.Random(0)
+    points = [wxPoint(rng.randrange(FromMM(252)), rng.randrange(-FromMM(20), FromMM(20))) for _ in range(100)]
+
+    def run() -> None:
+        for p in points:
+            index.hit(p, FromMM(0.6), FromMM(0.075))
+    return run
+
+
+@benchmark('board_builder')
+def bench_board_builder():
+    def run() -> None:
+        builder = utils.BoardBuilder(pcbnew.BOARD())
+        draw_station(builder)
+        builder.commit()
+    return run
@@ -0,0 +1,139 @@
+"""A lightweight stand-in for the parts of `pcbnew` used by the benchmarked code, so benchmarks
+run headless and don't depend on the speed of a KiCad build"""
+
+class wxPoint:
+    """Like KiCad's wrapper, there are no in-place operators, so `p += q` rebinds p to a new point"""
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x=0, y=0):
+        self.x = int(x)
+        self.y = int(y)
+
+    def __add__(self, other):
+        return wxPoint(self.x + other.x, self.y + other.y)
+
+    def __sub__(self, other):
+        return wxPoint(self.x - other.x, self.y - other.y)
+
+    def __eq__(self, other):
+        return isinstance(other, wxPoint) and self.x == other.x and self.y == other.y
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return f'wxPoint({self.x}, {self.y})'
+
+
+def FromMM(mm):
+    return int(round(mm * 1e6))
+
+
+def ToMM(iu):
+    return iu / 1e6
+
+
+# Layers and shapes, only compared by identity
+F_Cu = 0
+B_Cu = 31
+B_SilkS = 36
+Edge_Cuts = 44
+PCB_LAYER_ID_COUNT = 59
+PAD_SHAPE_CIRCLE = 0
+PAD_SHAPE_RECT = 1
+PAD_SHAPE_OVAL = 2
+PAD_SHAPE_ROUNDRECT = 4
+PAD_SHAPE_CHAMFERED_RECT = 5
+SHAPE_T_SEGMENT = 0
+SHAPE_T_CIRCLE = 3
+VIATYPE_THROUGH = 3
+PCB_VIA_T = 7
+
+
+class BOARD:
+
+    def __init__(self):
+        self.tracks = []
+        self.drawings = []
+
+    def Add(self, item):
+        (self.drawings if isinstance(item, PCB_SHAPE) else self.tracks).append(item)
+
+    def GetTracks(self):
+        return self.tracks
+
+    def GetDrawings(self):
+        return self.drawings
+
+
+class _Item:
+
+    def __init__(self, board=None):
+        self.start = wxPoint()
+        self.end = wxPoint()
+        self.width = 0
+        self.layer = F_Cu
+        self.shape = SHAPE_T_SEGMENT
+
+    def SetStart(self, pos):
+        self.start = wxPoint(pos.x, pos.y)
+
+    def SetEnd(self, pos):
+        self.end = wxPoint(pos.x, pos.y)
+
+    def GetStart(self):
+        return wxPoint(self.start.x, self.start.y)
+
+    def GetEnd(self):
+        return wxPoint(self.end.x, self.end.y)
+
+    def SetWidth(self, width):
+        self.width = int(width)
+
+    def GetWidth(self):
+        return self.width
+
+    def SetLayer(self, layer):
+        self.layer = layer
+
+    def GetLayer(self):
+        return self.layer
+
+    def SetShape(self, shape):
+        self.shape = shape
+
+
+class PCB_TRACK(_Item):
+    pass
+
+
+class PCB_SHAPE(_Item):
+    pass
+
+
+class PCB_VIA(_Item):
+
+    def SetLayerPair(self, top, bottom):
+        self.layers = (top, bottom)
+
+    def SetPosition(self, pos):
+        self.SetStart(pos)
+        self.SetEnd(pos)
+
+    def GetPosition(self):
+        return self.GetStart()
+
+    def SetViaType(self, via_type):
+        self.via_type = via_type
+
+
+class PAD:
+    pass
+
+
+class FOOTPRINT:
+    pass
+
+
+class ZONE:
+    pass
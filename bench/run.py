@@ -0,0 +1,100 @@
+"""Runs the benchmarks of `benchmarks.py` with `timeit`, and saves or compares their results.
+
+Benchmarks use a lightweight stand-in for pcbnew unless --kicad is given, so they run headless
+and their times only depend on this repository's code.
+
+    python bench/run.py --save before.json
+    python bench/run.py --compare before.json
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+from typing import Any, Dict
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+SRC_PATH = os.path.join(os.path.dirname(BENCH_PATH), 'src')
+# Ratio of medians beyond which a benchmark is reported as slower or faster
+THRESHOLD = 1.1
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_PATH, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def time_benchmark(setup, repeat: int, min_time: float) -> Dict[str, Any]:
+    """Times the callable returned by `setup` in `repeat` rounds of at least `min_time` seconds"""
+    run = setup()
+    timer = timeit.Timer(run)
+    (number, _) = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return {'number': number, 'min': min(times), 'median': statistics.median(times)}
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.3g} {unit}'
+    return f'{seconds / 1e-9:.3g} ns'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs microbenchmarks of the generator.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-k', '--filter', type=str, default='*', help='Run benchmarks whose names match this pattern')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Rounds per benchmark')
+    parser.add_argument('-t', '--min-time', type=float, default=0.2, help='Minimum seconds per round')
+    parser.add_argument('-m', '--map', type=str, action='append', default=[], help='Also time find_path on the walls of this NPZ file, like the <project>-route-heat.npz written by stations with ROUTER_STATS set')
+    parser.add_argument('--kicad', action='store_true', help='Use the pcbnew module of KiCad instead of the stand-in')
+    parser.add_argument('--save', type=str, default=None, help='Save the results to this JSON file')
+    parser.add_argument('--compare', type=str, default=None, help='Compare the results with this JSON file')
+    args = parser.parse_args()
+
+    sys.path.insert(0, SRC_PATH)
+    sys.path.insert(0, BENCH_PATH)
+    if not args.kicad:
+        import fake_pcbnew
+        sys.modules['pcbnew'] = fake_pcbnew
+    import benchmarks
+
+    for path in args.map:
+        name = 'find_path_map_' + os.path.splitext(os.path.basename(path))[0]
+        benchmarks.BENCHMARKS[name] = lambda path=path: benchmarks.find_paths_on(benchmarks.load_map(path), 'astar')
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+
+    results = {}
+    for name, setup in benchmarks.BENCHMARKS.items():
+        if not fnmatch.fnmatch(name, args.filter):
+            continue
+        results[name] = r = time_benchmark(setup, args.repeat, args.min_time)
+        line = f'{name:<28} {format_time(r["median"]):>10} median {format_time(r["min"]):>10} min'
+        if name in baseline:
+            ratio = r['median'] / baseline[name]['median']
+            mark = 'slower' if ratio > THRESHOLD else 'faster' if ratio < 1 / THRESHOLD else ''
+            line += f'   x{ratio:.2f} {mark}'
+        print(line, flush=True)
+
+    if args.save:
+        report = {
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'kicad': args.kicad,
+            'results': results,
+        }
+        with open(args.save, 'w') as file:
+            json.dump(report, file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, List
+
+# Bytes of artifacts kept on disk, the least recently used entries are evicted beyond this
+ARTIFACT_CACHE_SIZE = 1024 * 1024 * 1024
+
+def get_digest(paths: List[str]) -> str:
+    """Returns a digest of the names and contents of the files in `paths`, walking directories in a
+    stable order"""
+    digest = hashlib.sha256()
+    for root in paths:
+        if os.path.isfile(root):
+            (root, files) = (os.path.dirname(root), [root])
+        else:
+            files = sorted(os.path.join(d, f) for d, _, fs in os.walk(root) for f in fs)
+        for file in files:
+            digest.update(os.path.relpath(file, root).replace('\\', '/').encode())
+            with open(file, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """A content-addressed store of generated files.
+
+    An entry is a directory holding files by name, keyed by a digest of the parameters that
+    produced them. Entries are renamed into place once complete, and fetching an entry bumps its
+    modification time, which orders the eviction.
+    """
+
+    def __init__(self, path: str, max_size: int = ARTIFACT_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def get_key(params: dict) -> str:
+        """Returns the key of `params`, which must be JSON serializable"""
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def fetch(self, key: str, files: Dict[str, str]) -> bool:
+        """Copies the files of the entry `key` to the paths of their names in `files`.
+
+        Returns:
+            False if the entry doesn't hold all of them.
+        """
+        entry = os.path.join(self.path, key)
+        sources = {name: os.path.join(entry, name) for name in files}
+        if not all(os.path.isfile(src) for src in sources.values()):
+            return False
+        try:
+            for name, dst in files.items():
+                shutil.copyfile(sources[name], dst)
+            os.utime(entry)
+        except OSError:
+            return False
+        return True
+
+    def store(self, key: str, files: Dict[str, str]) -> None:
+        """Copies the paths in `files` to the entry `key` under their names, then evicts entries
+        beyond `max_size`"""
+        os.makedirs(self.path, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+        try:
+            for name, src in files.items():
+                shutil.copyfile(src, os.path.join(tmp, name))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        entry = os.path.join(self.path, key)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Another process stored the entry meanwhile
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for e in os.scandir(self.path):
+            # Hidden folders are entries being stored, or other caches sharing the directory
+            if e.is_dir() and not e.name.startswith('.'):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(e.path))
+                    entries.append((e.stat().st_mtime, size, e.path))
+                except OSError:
+                    continue
+        total = sum(size for _, size, _ in entries)
+        for (_, size, entry) in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
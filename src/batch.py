@@ -0,0 +1,135 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+GENERATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generate.py')
+# Manifest columns passed to generate.py as options, the others are positional
+OPTIONS = {
+    'height': '--height',
+    'diameter': '--diameter',
+    'track_width': '--track-width',
+    'track_space': '--track-space',
+    'cache': '--cache',
+}
+FLAGS = {
+    'box': '--box',
+    'keep_tmp_files': '--keep-tmp-files',
+    'profile': '--profile',
+}
+POSITIONALS = ['file', 'size', 'layers']
+
+def read_manifest(path: str) -> List[Dict[str, Any]]:
+    """Reads the jobs of a JSON manifest, a list of objects, or a CSV manifest with a header.
+    Keys are the argument names of generate.py with underscores, like `track_width`."""
+    with open(path, newline='') as file:
+        if path.lower().endswith('.json'):
+            jobs = json.load(file)
+        else:
+            jobs = list(csv.DictReader(file))
+    names = [str(job['file']) for job in jobs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f'Duplicate file names in manifest: {", ".join(sorted(duplicates))}')
+    return jobs
+
+
+def _is_set(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def get_argv(job: Dict[str, Any], extra_options: List[str] = ()) -> List[str]:
+    """Returns the arguments of generate.py for `job`, with `extra_options` before its positionals"""
+    unknown = set(job) - set(OPTIONS) - set(FLAGS) - set(POSITIONALS)
+    if unknown:
+        raise ValueError(f'Unknown manifest columns: {", ".join(sorted(unknown))}')
+    argv = []
+    for key, option in OPTIONS.items():
+        value = job.get(key)
+        if value in (None, '') or value is False:
+            continue
+        # A true boolean gives the option without a value, like `--cache` for the default directory
+        argv += [option] if value is True else [option, str(value)]
+    for key, flag in FLAGS.items():
+        if _is_set(job.get(key)):
+            argv.append(flag)
+    return argv + list(extra_options) + ['--'] + [str(job[key]) for key in POSITIONALS]
+
+
+def run_job(job: Dict[str, Any], out_dir: str) -> Dict[str, Any]:
+    """Generates `job` in a subprocess working in its own folder of `out_dir`.
+    Its output goes to `output.txt` in the folder."""
+    job_dir = os.path.abspath(os.path.join(out_dir, str(job['file'])))
+    os.makedirs(job_dir, exist_ok=True)
+    log_file = os.path.join(job_dir, 'log.txt')
+    if os.path.exists(log_file):
+        os.remove(log_file)
+    result = {'file': str(job['file']), 'dir': job_dir}
+    start = time.perf_counter()
+    try:
+        argv = get_argv(job)
+        with open(os.path.join(job_dir, 'output.txt'), 'w') as output:
+            process = subprocess.run([sys.executable, GENERATE_PATH] + argv, cwd=job_dir, stdout=output, stderr=subprocess.STDOUT)
+        result['returncode'] = process.returncode
+        # generate.py logs failed steps instead of raising
+        errors = ''
+        if os.path.exists(log_file):
+            with open(log_file) as file:
+                errors = file.read()
+        if process.returncode:
+            errors += f'generate.py exited with {process.returncode}\n'
+    except Exception as err:
+        errors = f'Job not started\nError: {err}\n'
+    result['seconds'] = time.perf_counter() - start
+    result['ok'] = not errors
+    result['errors'] = errors
+    return result
+
+
+def run_batch(jobs: List[Dict[str, Any]], out_dir: str, workers: int = None) -> Dict[str, Any]:
+    """Generates `jobs` in `workers` processes at a time, all CPUs by default.
+
+    Returns:
+        A summary with the result of each job in order: its folder, time, and errors if it failed.
+    """
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(lambda job: run_job(job, out_dir), jobs))
+    return {
+        'workers': workers,
+        'seconds': time.perf_counter() - start,
+        'failed': sum(not r['ok'] for r in results),
+        'jobs': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generates the NFCStack boxes and stations of a manifest in parallel, each in its own folder.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Designs generated at a time, all CPUs if not given')
+    parser.add_argument('-o', '--output-dir', type=str, default='.', help='Directory of the design folders and the summary')
+    parser.add_argument('manifest', type=str, help='CSV or JSON manifest of designs, with the argument names of generate.py as keys')
+    args = parser.parse_args()
+
+    jobs = read_manifest(args.manifest)
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary = run_batch(jobs, args.output_dir, args.jobs)
+    summary_path = os.path.join(args.output_dir, 'summary.json')
+    with open(summary_path, 'w') as file:
+        json.dump(summary, file, indent=2)
+    for r in summary['jobs']:
+        print(f"{r['file']}: {'ok' if r['ok'] else 'FAILED'} in {r['seconds']:.1f} s")
+    print(f"{len(jobs) - summary['failed']} of {len(jobs)} designs generated in {summary['seconds']:.1f} s, see {summary_path}")
+    sys.exit(1 if summary['failed'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -22,8 +22,8 @@ class Box(Cuboid):
         for i in range(self.side):
             for j in range(self.coil_n):
                 if not ((i == self.side - 1 ) and (j == self.coil_n - 1)):
-                    self.coil_top.append(Coil(self.board, self.coil_style, wxPoint(i * self.length + (j + 0.5) * l, -0.5 * l), math.radians(90), True))
-                    self.coil_bottom.append(Coil(self.board, self.coil_style, wxPoint(i * self.length + (j + 1.5) * l, 0.5 * l + self.height), math.radians(90)))
+                    self.coil_top.append(Coil(self.builder, self.coil_style, wxPoint(i * self.length + (j + 0.5) * l, -0.5 * l), math.radians(90), True))
+                    self.coil_bottom.append(Coil(self.builder, self.coil_style, wxPoint(i * self.length + (j + 1.5) * l, 0.5 * l + self.height), math.radians(90)))
 
     def _init_footprints(self) -> None:
         self.c_coil_top: List[pcbnew.FOOTPRINT] = [self.board.FindFootprintByReference(p.ref) for p in self.sch.c_coil_top]
@@ -46,8 +46,8 @@ class Box(Cuboid):
 
     def _route(self) -> None:
         for ct, cb in zip(self.c_coil_top, self.c_coil_bottom):
-            utils.segment(self.board, ct.Pads()[0].GetPosition(), cb.Pads()[0].GetPosition(), self.coil_style.track_w, pcbnew.F_Cu)
-            utils.segment(self.board, ct.Pads()[1].GetPosition(), cb.Pads()[1].GetPosition(), self.coil_style.track_w, pcbnew.F_Cu)
+            utils.segment(self.builder, ct.Pads()[0].GetPosition(), cb.Pads()[0].GetPosition(), self.coil_style.track_w, pcbnew.F_Cu)
+            utils.segment(self.builder, ct.Pads()[1].GetPosition(), cb.Pads()[1].GetPosition(), self.coil_style.track_w, pcbnew.F_Cu)
 
     def _create_coils(self) -> None:
         for cap, co in zip(self.c_coil_top, self.coil_top):
@@ -59,4 +59,4 @@ class Box(Cuboid):
 
     def _create_markers(self) -> None:
         l = self.length / (self.coil_n + 1) / 2
-        utils.circle(self.board, wxPoint(self.side * self.length - l, self.height + l), self.tag_d, self.outline_width, pcbnew.B_SilkS, False)
\ No newline at end of file
+        utils.circle(self.builder, wxPoint(self.side * self.length - l, self.height + l), self.tag_d, self.outline_width, pcbnew.B_SilkS, False)
\ No newline at end of file
@@ -1,14 +1,84 @@
+import functools
 import math
+import numpy as np
 import pcbnew
 from pcbnew import BOARD, wxPoint
-from typing import Tuple
+from typing import List, NamedTuple, Tuple, Union
 
-from eseries import find_nearest, E24
+from eseries import erange, E24
 import utils
 import vector
 
+class CoilValues(NamedTuple):
+    """Arrays of the turns, inductance (H), required capacitance (F) and nearest E24 capacitance (F)
+    of square NFC antennas, see `evaluate_coils`"""
+    turns: np.ndarray
+    L: np.ndarray
+    C: np.ndarray
+    C_recommend: np.ndarray
+
+
+def get_inductance(diameter_M: np.ndarray, track_w_M: np.ndarray, track_s_M: np.ndarray, turns: np.ndarray) -> np.ndarray:
+    """Returns the inductance of square antennas, with dimensions in meters"""
+    do = diameter_M
+    di = do - 2 * (turns * track_w_M + (turns - 1) * track_s_M)
+    d = (do + di) / 2
+    ratio = (do - di) / (do + di)
+    k1, k2, mu = 2.34, 2.75, 4 * math.pi * 1e-7
+    return k1 * mu * (turns ** 2) * (d / (1 + k2 * ratio))
+
+
+def get_optimal_turns(diameter_M: np.ndarray, track_w_M: np.ndarray, track_s_M: np.ndarray) -> np.ndarray:
+    """Returns the turns after which the inductance of square antennas stops increasing, at most
+    as many turns as fit in them"""
+    max_turns = (diameter_M / (track_w_M + track_s_M) / 2).astype(np.int64)
+    n = np.arange(1, max(int(max_turns.max(initial=0)), 1) + 1)
+    # Turns beyond those that fit may divide by zero, they are masked out below
+    with np.errstate(divide='ignore', invalid='ignore'):
+        L = get_inductance(diameter_M[..., None], track_w_M[..., None], track_s_M[..., None], n)
+    prev_L = np.concatenate([np.zeros(L.shape[:-1] + (1,)), L[..., :-1]], axis=-1)
+    drops = (L < prev_L) & (n <= max_turns[..., None])
+    return np.where(drops.any(axis=-1), np.argmax(drops, axis=-1), max_turns)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_E24_around(decade: int) -> np.ndarray:
+    """Returns the E24 values of the decades around 10^decade, as rounded by eseries"""
+    return np.array(list(erange(E24, 10.0 ** (decade - 1), 10.0 ** (decade + 2))))
+
+
+def find_nearest_E24(values: np.ndarray) -> np.ndarray:
+    """`eseries.find_nearest(E24, value)` of each value, NaN where there is none"""
+    values = np.asarray(values, dtype=float)
+    nearest = np.full(values.shape, np.nan)
+    valid = np.isfinite(values) & (values > 0)
+    decades = np.floor(np.log10(values, where=valid, out=np.zeros(values.shape)))
+    for decade in np.unique(decades[valid]):
+        # The decades around the value hold its neighbours
+        candidates = _get_E24_around(int(decade))
+        mask = valid & (decades == decade)
+        # Ties go to the lower value like in eseries, as argmin returns the first
+        nearest[mask] = candidates[np.argmin(np.abs(candidates - values[mask][:, None]), axis=1)]
+    return nearest
+
+
+def evaluate_coils(diameter, track_w, track_s, frequency=13.56e6, turns=None) -> CoilValues:
+    """Evaluates square NFC antennas for arrays of dimensions (nm) and frequencies (Hz), which are
+    broadcast together. Turns are optimal unless given. Antennas too small for a turn have no
+    inductance, an infinite C and a NaN C_recommend."""
+    (diameter, track_w, track_s, frequency) = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (diameter, track_w, track_s, frequency)))
+    (diameter_M, track_w_M, track_s_M) = (1e-9 * diameter, 1e-9 * track_w, 1e-9 * track_s)
+    if turns is None:
+        turns = get_optimal_turns(diameter_M, track_w_M, track_s_M)
+    turns = np.broadcast_to(np.asarray(turns, dtype=np.int64), diameter.shape)
+    L = get_inductance(diameter_M, track_w_M, track_s_M, turns)
+    with np.errstate(divide='ignore'):
+        C = 1 / (4 * math.pi * math.pi * (frequency ** 2) * L)
+    return CoilValues(turns, L, C, find_nearest_E24(C))
+
+
 class CoilStyle:
-    """Properties of a square NFC antenna"""
+    """Properties of a square NFC antenna, see `evaluate_coils` to evaluate many at once"""
 
     def __init__(self, diameter: int, track_w: int, track_s: int, *, frequency: float = 13.56e6, q_factor: float = 100, turns: int = None):
         self.diameter = diameter
@@ -21,12 +91,13 @@ class CoilStyle:
         self.track_w_M = 1e-9 * track_w
         self.track_s_M = 1e-9 * track_s
 
-        if not turns:
-            self.turns = self._get_optimal_turns()
-
-        self.L = self._get_L()
-        self.C = self._get_required_C()
-        self.C_recommend = find_nearest(E24, self.C)
+        values = evaluate_coils(diameter, track_w, track_s, frequency, turns or None)
+        self.turns = int(values.turns)
+        if not self.turns:
+            raise ValueError(f'A coil of {diameter / 1e6} mm has no room for a turn of {track_w / 1e6} mm tracks')
+        self.L = float(values.L)
+        self.C = float(values.C)
+        self.C_recommend = float(values.C_recommend)
 
     def __repr__(self) -> str:
         return (
@@ -40,36 +111,6 @@ class CoilStyle:
             f'  L: {self.get_L_repr()}'
         )
 
-    def _get_inner_diameter(self, turns: int = None) -> float:
-        """In meters"""
-        if not turns:
-            turns = self.turns
-        return self.diameter_M - 2 * (turns * self.track_w_M + (turns - 1) * self.track_s_M)
-
-    def _get_L(self, turns: int = None) -> float:
-        """Returns the inductance of a square antenna"""
-        if not turns:
-            turns = self.turns
-        do = self.diameter_M
-        di = self._get_inner_diameter(turns)
-        d = (do + di) / 2
-        ratio = (do - di) / (do + di)
-        k1, k2, mu = 2.34, 2.75, 4 * math.pi * 1e-7
-        return k1 * mu * (turns ** 2) * (d / (1 + k2 * ratio))
-
-    def _get_required_C(self) -> float:
-        return 1 / (4 * math.pi * math.pi * (self.freq ** 2) * self._get_L())
-
-    def _get_optimal_turns(self) -> int:
-        max_turns = int(self.diameter_M / (self.track_w_M + self.track_s_M) / 2)
-        prev_l = 0
-        for curr_turns in range(1, max_turns + 1):
-            curr_l = self._get_L(curr_turns)
-            if (curr_l < prev_l):
-                return curr_turns - 1
-            prev_l = curr_l
-        return max_turns
-
     def _get_repr(self, val: float) -> str:
         try:
             if val < 1e-9:
@@ -96,9 +137,30 @@ class CoilStyle:
         return self._get_repr(self.C_recommend) + 'F'
 
 
+@functools.lru_cache(maxsize=None)
+def get_spiral_template(diameter: int, track_w: int, track_s: int, turns: int) -> np.ndarray:
+    """Returns the start, the end and the spiral of a coil centered at the origin, before it is
+    flipped, rotated and placed, as a read-only array of points shared by coils of the same style"""
+    length = diameter - track_w
+    start = wxPoint(-length / 2, -length / 2)
+    points = [(start.x, start.y), (start.x - (track_w + track_s), start.y + track_w + track_s)]
+    (x, y) = (start.x, start.y)
+    heading = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+    points.append((x, y))
+    for i in range(turns):
+        for j in range(4):
+            (x, y) = (x + heading[j][0] * length, y + heading[j][1] * length)
+            points.append((x, y))
+            if (j == 0 and i > 0) or (j == 2):
+                length -= track_w + track_s
+    template = np.array(points, dtype=np.int64)
+    template.setflags(write=False)
+    return template
+
+
 class Coil:
 
-    def __init__(self, board: BOARD, style: CoilStyle, pos: wxPoint, angle: float, flip: bool = False):
+    def __init__(self, board: Union[BOARD, utils.BoardBuilder], style: CoilStyle, pos: wxPoint, angle: float, flip: bool = False):
         self.board = board
         self.diameter = style.diameter
         self.track_w = style.track_w
@@ -107,27 +169,34 @@ class Coil:
         self.pos = pos
         self.angle = angle
         self.flip = flip
-        self._init_points()
-
-    def _init_points(self) -> None:
-        length = self.diameter - self.track_w
-        self.start = wxPoint(-length / 2, -length / 2)
-        self.end = self.start + wxPoint(-(self.track_w + self.track_s), self.track_w + self.track_s)
-        curr = vector.copy(self.start)
-        heading = [wxPoint(1, 0), wxPoint(0, 1), wxPoint(-1, 0), wxPoint(0, -1)]
-        self.spiral = []
-        self.spiral.append(curr)
-        for i in range(self.turns):
-            for j in range(4):
-                curr += vector.multiplied(heading[j], length)
-                self.spiral.append(vector.copy(curr))
-                if (j == 0 and i > 0) or (j == 2):
-                    length -= self.track_w + self.track_s
-
-        self._translate(self.start)
-        self._translate(self.end)
-        for p in self.spiral:
-            self._translate(p)
+        self._template = get_spiral_template(self.diameter, self.track_w, self.track_s, self.turns)
+
+    @functools.cached_property
+    def _terminal(self) -> Tuple[wxPoint, wxPoint]:
+        (start, end) = (wxPoint(x, y) for x, y in self._template[:2].tolist())
+        self._translate(start)
+        self._translate(end)
+        return (start, end)
+
+    @property
+    def start(self) -> wxPoint:
+        return vector.copy(self._terminal[0])
+
+    @property
+    def end(self) -> wxPoint:
+        return vector.copy(self._terminal[1])
+
+    @functools.cached_property
+    def spiral(self) -> List[wxPoint]:
+        """The points of the spiral, translated at once the way `_translate` translates a point"""
+        (x, y) = (self._template[2:, 0], self._template[2:, 1])
+        if self.flip:
+            x = -x
+        (cos, sin) = (math.cos(self.angle), math.sin(self.angle))
+        # astype truncates like the int() of `vector.rotate`
+        xs = (x * cos - y * sin).astype(np.int64) + self.pos.x
+        ys = (x * sin + y * cos).astype(np.int64) + self.pos.y
+        return [wxPoint(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
 
     def _translate(self, v: wxPoint) -> None:
         if self.flip:
@@ -142,7 +211,7 @@ class Coil:
         utils.via(self.board, self.end, self.track_w, pcbnew.F_Cu, pcbnew.B_Cu)
 
     def get_terminal(self) -> Tuple[wxPoint, wxPoint]:
-        return (vector.copy(self.start), vector.copy(self.end))
+        return (self.start, self.end)
 
     def extend(self, cap: pcbnew.FOOTPRINT) -> None:
         pads = [p.GetPosition() for p in cap.Pads()]
@@ -4,6 +4,7 @@ import pcbnew
 from pcbnew import FromMM, wxPoint, BOARD
 
 from coil import CoilStyle
+import instrument
 from schematic import Schematic
 import utils
 import vector
@@ -12,6 +13,7 @@ class Cuboid(ABC):
 
     def __init__(self, board: BOARD, sch: Schematic, coil_style: CoilStyle, length: int, height: int, stack_n: int):
         self.board = board
+        self.builder = utils.BoardBuilder(board)
         self.sch = sch
         self.coil_style = coil_style
         self.length = length
@@ -25,6 +27,7 @@ class Cuboid(ABC):
 
     def _update_board(self) -> None:
         self.board = pcbnew.LoadBoard(self.board.GetFileName())
+        self.builder = utils.BoardBuilder(self.board)
         self._init_coils()
         self._init_footprints()
 
@@ -36,7 +39,7 @@ class Cuboid(ABC):
             wxPoint(-width, self.height - offset),
             wxPoint(0, self.height),
         ]
-        utils.polyline(self.board, points, self.outline_width, pcbnew.Edge_Cuts, False)
+        utils.polyline(self.builder, points, self.outline_width, pcbnew.Edge_Cuts, False)
 
     def _create_wing(self, pos: wxPoint, angle: float, coil_n: int) -> None:
         tolerance = FromMM(0.8)
@@ -55,7 +58,7 @@ class Cuboid(ABC):
         for p in points:
             vector.rotate(p, angle)
             vector.add(p, pos)
-        utils.polyline(self.board, points, self.outline_width, pcbnew.Edge_Cuts, False)
+        utils.polyline(self.builder, points, self.outline_width, pcbnew.Edge_Cuts, False)
 
         points = [
             wxPoint(l, l / 3 + tolerance),
@@ -67,12 +70,12 @@ class Cuboid(ABC):
         for p in points:
             vector.rotate(p, angle)
             vector.add(p, pos)
-        utils.polyline(self.board, points, self.outline_width, pcbnew.Edge_Cuts, False)
+        utils.polyline(self.builder, points, self.outline_width, pcbnew.Edge_Cuts, False)
 
     def _create_outline(self) -> None:
         self._create_tab()
         utils.segment(
-            self.board, 
+            self.builder, 
             wxPoint(self.side * self.length, 0), 
             wxPoint(self.side * self.length, self.height), 
             self.outline_width, 
@@ -88,10 +91,11 @@ class Cuboid(ABC):
         diameter = FromMM(0.6)
         distance = FromMM(1)
         clearance = FromMM(0.075)
-        utils.fold_line(self.board, wxPoint(0, 0), wxPoint(self.side * self.length, 0), diameter, distance, self.outline_width, clearance)
-        utils.fold_line(self.board, wxPoint(0, self.height), wxPoint(self.side * self.length, self.height), diameter, distance, self.outline_width, clearance)
+        index = utils.SegmentIndex(self.builder)
+        utils.fold_line(self.builder, wxPoint(0, 0), wxPoint(self.side * self.length, 0), diameter, distance, self.outline_width, clearance, index)
+        utils.fold_line(self.builder, wxPoint(0, self.height), wxPoint(self.side * self.length, self.height), diameter, distance, self.outline_width, clearance, index)
         for i in range(self.side):
-            utils.fold_line(self.board, wxPoint(i * self.length, 0), wxPoint(i * self.length, self.height), diameter, distance, self.outline_width, clearance)
+            utils.fold_line(self.builder, wxPoint(i * self.length, 0), wxPoint(i * self.length, self.height), diameter, distance, self.outline_width, clearance, index)
 
     @abstractmethod
     def _init_coils(self) -> None:
@@ -126,10 +130,12 @@ class Cuboid(ABC):
         pass
 
     def create(self) -> BOARD:
-        self._layout()
-        self._route()
-        self._create_outline()
-        self._create_coils()
-        self._create_foldline()
-        self._create_markers()
+        """Creates the board, recording each step as a stage, see `instrument.stage`. Tracks and
+        shapes are drawn into `builder`, and added to the board in its final `commit` step."""
+        for step in (self._layout, self._route, self._create_outline, self._create_coils, self._create_foldline, self._create_markers):
+            with instrument.stage(step.__name__):
+                step()
+        # Steps may replace the builder, e.g. when reloading the board after autorouting
+        with instrument.stage('commit'):
+            self.builder.commit()
         return self.board
\ No newline at end of file
@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import socketserver
+import sys
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterable
+
+import skidl
+
+import batch
+import generate
+import schematic
+
+def warm_up() -> None:
+    """Loads the symbol libraries of both schematics, so that jobs find them parsed"""
+    start = time.perf_counter()
+    for sch_type in (schematic.StationSchematic, schematic.BoxSchematic):
+        sch_type(4, '1nF')
+    skidl.default_circuit.mini_reset()
+    print(f'Warmed up in {time.perf_counter() - start:.1f} s', file=sys.stderr)
+
+
+def run_request(request: Dict[str, Any], send: Callable[[Dict[str, Any]], None]) -> None:
+    """Generates the design of `request` and sends its events.
+
+    A request has the keys of a `batch` manifest job, plus an optional `id` echoed in its events
+    and an optional `output_dir`, the current working directory by default. Events are `started`,
+    then `done` with the paths of the artifacts and the errors of the failed steps, or `failed`
+    if the request is invalid.
+    """
+    request = dict(request)
+    rid = request.pop('id', None)
+    out_dir = os.path.abspath(request.pop('output_dir', None) or '.')
+    try:
+        args = generate.parse_args(batch.get_argv(request, ['--output-dir', out_dir]))
+    except (Exception, SystemExit) as err:
+        send({'id': rid, 'event': 'failed', 'errors': f'Invalid request\nError: {err}\n'})
+        return
+
+    send({'id': rid, 'event': 'started'})
+    start = time.perf_counter()
+    skidl.default_circuit.mini_reset()
+    errors = ''
+    try:
+        generate.run(args)
+    except Exception:
+        errors = traceback.format_exc()
+    log_file = os.path.join(out_dir, 'log.txt')
+    if os.path.exists(log_file):
+        with open(log_file) as file:
+            errors = file.read() + errors
+    outputs = generate.get_outputs(args.file or 'untitled', out_dir)
+    send({
+        'id': rid,
+        'event': 'done',
+        'ok': not errors,
+        'seconds': time.perf_counter() - start,
+        'artifacts': {kind: path for kind, path in outputs.items() if os.path.exists(path)},
+        'errors': errors,
+    })
+
+
+def serve_lines(lines: Iterable[str], write: Callable[[str], None]) -> None:
+    """Runs the JSON requests read one per line from `lines`, writing their events as JSON lines"""
+    def send(event: Dict[str, Any]) -> None:
+        write(json.dumps(event) + '\n')
+
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as err:
+            send({'id': None, 'event': 'failed', 'errors': f'Invalid JSON\nError: {err}\n'})
+            continue
+        run_request(request, send)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self) -> None:
+        def write(s: str) -> None:
+            self.wfile.write(s.encode())
+            self.wfile.flush()
+
+        serve_lines((line.decode() for line in self.rfile), write)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generates NFCStack designs requested as JSON lines, with KiCad and skidl loaded once.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-S', '--socket', type=str, default=None, help='Serve requests on this Unix socket instead of stdin')
+    args = parser.parse_args()
+
+    # Keep stdout for events, prints of the generator go to stderr
+    events = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    warm_up()
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        # Requests are served one at a time, since skidl keeps the circuit in a global
+        with socketserver.UnixStreamServer(args.socket, RequestHandler) as server:
+            print(f'Serving on {args.socket}', file=sys.stderr)
+            try:
+                server.serve_forever()
+            finally:
+                os.remove(args.socket)
+    else:
+        def write(s: str) -> None:
+            events.write(s)
+            events.flush()
+
+        serve_lines(sys.stdin, write)
+
+if __name__ == '__main__':
+    main()
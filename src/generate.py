@@ -1,19 +1,73 @@
 import argparse
+import glob
 import os
 import shutil
 import pcbnew
 from pcbnew import FromMM
+import skidl
+from typing import Dict, List
 
+from artifact_cache import ArtifactCache, get_digest
 from box import Box
 from coil import CoilStyle
 from cuboid import Cuboid
 import fabrication
 import gerber_plot
+import instrument
 import schematic
+import station
 from station import Station
 import utils
 
-def generate(project_name: str, block_type: Cuboid, sch_type: schematic.Schematic, stack_n: int, length: float, height: float, coil_d: float, coil_track_w: float, coil_track_s: float, keep_tmp: bool) -> None:
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+# Default directory of the artifact cache shared by all runs
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'nfc-stack-fpc', 'artifacts')
+# Folder of the cache directory holding routed nets, hidden from the eviction of artifacts
+ROUTE_CACHE_DIR = '.routes'
+
+def get_generator_version() -> str:
+    """Returns the versions of KiCad and skidl and a digest of the generator sources and libraries"""
+    root = os.path.dirname(SRC_PATH)
+    sources = sorted(glob.glob(os.path.join(SRC_PATH, '*.py')))
+    sources += [os.path.join(SRC_PATH, 'tools'), os.path.join(root, 'footprints'), os.path.join(root, 'symbols')]
+    return f'{pcbnew.GetBuildVersion()}/{skidl.__version__}/{get_digest(sources)}'
+
+
+def get_outputs(project_name: str, out_dir: str) -> Dict[str, str]:
+    """Returns the paths of the files generated for `project_name` in `out_dir`, by kind"""
+    return {
+        'Gerber.zip': os.path.join(out_dir, project_name + '-Gerber.zip').replace('\\', '/'),
+        'pos.csv': os.path.join(out_dir, project_name + '-pos.csv').replace('\\', '/'),
+        'bom.csv': os.path.join(out_dir, project_name + '-bom.csv').replace('\\', '/'),
+    }
+
+
+def generate(project_name: str, block_type: Cuboid, sch_type: schematic.Schematic, stack_n: int, length: float, height: float, coil_d: float, coil_track_w: float, coil_track_s: float, keep_tmp: bool, cache: ArtifactCache = None, out_dir: str = None, profile: bool = False) -> None:
+    """Generates the Gerber ZIP, pos and BOM files of a design in `out_dir`, the current working
+    directory by default. Temporary files go to its `tmp` folder, and errors to its `log.txt`.
+    The working directory isn't changed, so designs with different `out_dir` may be generated at once.
+
+    If `cache` is given, the files are fetched from it if they were generated before with the same
+    parameters and generator version, and stored in it otherwise. Runs keeping temporary files
+    skip the cache.
+
+    The wall time, CPU time and growth of the process peak RSS of each stage are written to
+    `<project>-report.json`.
+    With `profile`, cProfile statistics of each stage are dumped to `<project>-profile/<stage>.prof`.
+    """
+    name = project_name or 'untitled'
+    cwd_path = os.path.abspath(out_dir or os.getcwd())
+    recorder = instrument.Recorder(os.path.join(cwd_path, name + '-profile') if profile else None)
+    with instrument.recording(recorder):
+        _generate(project_name, block_type, sch_type, stack_n, length, height, coil_d, coil_track_w, coil_track_s, keep_tmp, cache, cwd_path)
+    try:
+        recorder.save(os.path.join(cwd_path, name + '-report.json'))
+    except Exception as err:
+        with open(os.path.join(cwd_path, 'log.txt'), 'a') as file:
+            file.write(f'Report not saved\nError: {err}\n')
+
+
+def _generate(project_name: str, block_type: Cuboid, sch_type: schematic.Schematic, stack_n: int, length: float, height: float, coil_d: float, coil_track_w: float, coil_track_s: float, keep_tmp: bool, cache: ArtifactCache, out_dir: str) -> None:
     stack_n = utils.round_to_four(stack_n)
     length = FromMM(length)
     height = FromMM(height)
@@ -25,14 +79,15 @@ def generate(project_name: str, block_type: Cuboid, sch_type: schematic.Schemati
     try:
         if not project_name:
             project_name = 'untitled'
-        cwd_path = os.getcwd()
+        cwd_path = os.path.abspath(out_dir or os.getcwd())
         tmp_path = os.path.join(cwd_path, 'tmp').replace('\\', '/')
         tmp_output_path = os.path.join(tmp_path, project_name + '-Gerber').replace('\\', '/')
         pcb_path = os.path.join(tmp_path, project_name + '.kicad_pcb').replace('\\', '/')
         pcb_path_final = os.path.join(tmp_path, project_name + '_final.kicad_pcb').replace('\\', '/')
-        output_path = os.path.join(cwd_path, project_name + '-Gerber').replace('\\', '/')
-        pos_path = os.path.join(cwd_path, project_name + '-pos.csv').replace('\\', '/')
-        bom_path = os.path.join(cwd_path, project_name + '-bom.csv').replace('\\', '/')
+        outputs = get_outputs(project_name, cwd_path)
+        output_path = os.path.splitext(outputs['Gerber.zip'])[0]
+        pos_path = outputs['pos.csv']
+        bom_path = outputs['bom.csv']
         log_file = os.path.join(cwd_path, 'log.txt').replace('\\', '/')
         if os.path.exists(log_file):
             os.remove(log_file)
@@ -40,6 +95,31 @@ def generate(project_name: str, block_type: Cuboid, sch_type: schematic.Schemati
         with open(log_file, 'a') as file:
             file.write(f'Startup error\nError: {err}\n')
 
+    # Fetch the outputs from the cache
+    cache_key = None
+    if cache and not keep_tmp:
+        try:
+            # Gerbers and the board name the files after the project, so the name is a parameter too
+            with instrument.stage('cache_fetch'):
+                cache_key = cache.get_key({
+                    'version': get_generator_version(),
+                    'name': project_name,
+                    'block': block_type.__name__,
+                    'schematic': sch_type.__name__,
+                    'stack_n': stack_n,
+                    'length': length,
+                    'height': height if block_type == Station else None,
+                    'coil_d': coil_d,
+                    'coil_track_w': coil_track_w,
+                    'coil_track_s': coil_track_s,
+                })
+                if cache.fetch(cache_key, outputs):
+                    print('Outputs fetched from the cache')
+                    return
+        except Exception as err:
+            with open(log_file, 'a') as file:
+                file.write(f'Cache not read\nError: {err}\n')
+
     coil_style = CoilStyle(coil_d, coil_track_w, coil_track_s)
     c_val = coil_style.get_C_recommend_repr()
     print('Coil Style:', coil_style, sep='\n')
@@ -53,60 +133,63 @@ def generate(project_name: str, block_type: Cuboid, sch_type: schematic.Schemati
 
     # Create a PCB from schematic
     try:
-        os.chdir(tmp_path)
-        sch = sch_type(stack_n, c_val)
-        sch.generate_pcb(pcb_path)
-        os.chdir(cwd_path)
+        with instrument.stage('schematic'):
+            sch = sch_type(stack_n, c_val)
+            sch.generate_pcb(pcb_path)
     except Exception as err:
         with open(log_file, 'a') as file:
             file.write(f'PCB not created\nError: {err}')
 
     # Layout, route, and outline the PCB
     try:
-        board = pcbnew.LoadBoard(pcb_path)
-        if block_type == Station:
-            block = Station(board, sch, coil_style, length, height, stack_n)
-        else:
-            block = Box(board, sch, coil_style, length, stack_n)
-        board = block.create()
-        pcbnew.SaveBoard(pcb_path_final, board)
+        with instrument.stage('board'):
+            board = pcbnew.LoadBoard(pcb_path)
+            if block_type == Station:
+                block = Station(board, sch, coil_style, length, height, stack_n)
+            else:
+                block = Box(board, sch, coil_style, length, stack_n)
+            board = block.create()
+            pcbnew.SaveBoard(pcb_path_final, board)
     except Exception as err:
         with open(log_file, 'a') as file:
             file.write(f'PCB not finished\nError: {err}')
 
     # Plot Gerbers
     try:
-        gerber_plot.generate_gerbers(board, tmp_output_path)
+        with instrument.stage('gerbers'):
+            gerber_plot.generate_gerbers(board, tmp_output_path)
     except Exception as err:
         with open(log_file, 'a') as file:
             file.write(f'Gerbers not plotted\nError: {err}')
 
     # Plot drill file
     try:
-        gerber_plot.generate_drill_file(board, tmp_output_path)
+        with instrument.stage('drill'):
+            gerber_plot.generate_drill_file(board, tmp_output_path)
     except Exception as err:
         with open(log_file, 'a') as file:
             file.write(f'Drill file not plotted\nError: {err}')
 
     # Create compressed file from tmp
     try:
-        os.chdir(tmp_output_path)
-        shutil.make_archive(output_path, 'zip')
-        os.chdir(cwd_path)
+        with instrument.stage('zip'):
+            shutil.make_archive(output_path, 'zip', tmp_output_path)
     except Exception as err:
         with open(log_file, 'a') as file:
             file.write(f'ZIP file not created\nError: {err}')
 
     # Export pick and place (pos) file
     try:
-        fabrication.export_pos(board, pos_path)
+        with instrument.stage('pos'):
+            fabrication.export_pos(board, pos_path)
     except Exception as err:
         with open(log_file, 'a') as file:
             file.write(f'pos file not exported\nError: {err}')
 
     # Export BOM
     try:
-        fabrication.export_bom(board, bom_path)
+        with instrument.stage('bom'):
+            fabrication.export_bom(board, bom_path)
     except Exception as err:
         with open(log_file, 'a') as file:
             file.write(f'BOM not exported\nError: {err}')
@@ -114,11 +197,21 @@ def generate(project_name: str, block_type: Cuboid, sch_type: schematic.Schemati
     if not keep_tmp:
         # Remove temp folder
         try:
-            shutil.rmtree(tmp_path, ignore_errors=True)
+            with instrument.stage('cleanup'):
+                shutil.rmtree(tmp_path, ignore_errors=True)
         except Exception as err:
             with open(log_file, 'a') as file:
                 file.write('temp folder not deleted\nError: {}\n'.format(err))
 
+    # Store the outputs in the cache unless a step failed
+    if cache_key and not os.path.exists(log_file) and all(os.path.exists(path) for path in outputs.values()):
+        try:
+            with instrument.stage('cache_store'):
+                cache.store(cache_key, outputs)
+        except Exception as err:
+            with open(log_file, 'a') as file:
+                file.write(f'Outputs not cached\nError: {err}\n')
+
 
 def export_config(path: str, config: dict) -> None:
     with open(path, 'w') as file:
@@ -126,7 +219,7 @@ def export_config(path: str, config: dict) -> None:
             file.write(f'{k}: {v}\n')
 
 
-def main():
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description='Generates fabrication files for NFCStack boxes and stations. All lengths are measured in mm.',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -136,11 +229,18 @@ def main():
     parser.add_argument('-w', '--track-width', type=float, default=0.8, help='Coil track width')
     parser.add_argument('-s', '--track-space', type=float, default=0.6, help='Space between coil tracks')
     parser.add_argument('-k', '--keep-tmp-files', action='store_true', help='Keep temporary files')
+    parser.add_argument('-c', '--cache', type=str, nargs='?', const=CACHE_PATH, default=None, help='Fetch and store outputs in a cache directory, ' + CACHE_PATH + ' if no directory is given. Ignored with -k. Routed nets are cached in its ' + ROUTE_CACHE_DIR + ' folder.')
+    parser.add_argument('-p', '--profile', action='store_true', help='Profile each stage with cProfile')
+    parser.add_argument('-o', '--output-dir', type=str, default='.', help='Directory of the generated files')
     parser.add_argument('file', type=str, help='File name')
     parser.add_argument('size', type=float, help='Size')
     parser.add_argument('layers', type=int , help='Maximum layers of stacking')
-    args = parser.parse_args()
-    export_config('config.txt', vars(args))
+    return parser.parse_args(argv)
+
+
+def run(args: argparse.Namespace) -> None:
+    os.makedirs(args.output_dir, exist_ok=True)
+    export_config(os.path.join(args.output_dir, 'config.txt'), vars(args))
 
     if args.box:
         block_type = Box
@@ -148,7 +248,19 @@ def main():
     else:
         block_type = Station
         sch_type = schematic.StationSchematic
-    generate(args.file, block_type, sch_type, args.layers, args.size, args.height, args.diameter, args.track_width, args.track_space, args.keep_tmp_files)
+    cache = ArtifactCache(args.cache) if args.cache else None
+    # Stations cache routed nets only when asked to, and the daemon runs several designs in a process
+    route_cache = station.ROUTER_CACHE
+    if args.cache and route_cache is None:
+        station.ROUTER_CACHE = os.path.join(args.cache, ROUTE_CACHE_DIR)
+    try:
+        generate(args.file, block_type, sch_type, args.layers, args.size, args.height, args.diameter, args.track_width, args.track_space, args.keep_tmp_files, cache, args.output_dir, args.profile)
+    finally:
+        station.ROUTER_CACHE = route_cache
+
+
+def main():
+    run(parse_args())
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
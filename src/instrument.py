@@ -0,0 +1,98 @@
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Iterator, List
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS isn't recorded there
+    resource = None
+
+def get_peak_rss() -> int:
+    """Returns the peak resident set size of the process so far in KiB, or None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, KiB elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class Recorder:
+    """Records the wall time and CPU time of named stages, which may be nested, with the peak RSS
+    of the process at their end and how much they raised it. The peak is a high-water mark of the
+    whole process, so stages after the largest one report the same peak and no growth.
+
+    If `profile_dir` is given, top-level stages are also profiled with cProfile, and their
+    statistics are dumped to `<profile_dir>/<stage>.prof`.
+    """
+
+    def __init__(self, profile_dir: str = None):
+        self.profile_dir = profile_dir
+        self.stages: List[Dict[str, Any]] = []
+        self._path: List[str] = []
+        (self._wall, self._cpu) = (time.perf_counter(), time.process_time())
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        self._path.append(name)
+        record = {'stage': '/'.join(self._path)}
+        self.stages.append(record)
+        profiler = None
+        if self.profile_dir and len(self._path) == 1:
+            profiler = cProfile.Profile()
+        (wall, cpu, peak) = (time.perf_counter(), time.process_time(), get_peak_rss())
+        try:
+            if profiler:
+                profiler.enable()
+            yield
+        except BaseException as err:
+            record['error'] = f'{type(err).__name__}: {err}'
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.process_time() - cpu
+            record['process_peak_rss_kib'] = get_peak_rss()
+            record['peak_rss_growth_kib'] = None if peak is None else record['process_peak_rss_kib'] - peak
+            if profiler:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                record['profile'] = os.path.join(self.profile_dir, name + '.prof')
+                profiler.dump_stats(record['profile'])
+            self._path.pop()
+
+    def get_report(self) -> Dict[str, Any]:
+        return {
+            'wall_s': time.perf_counter() - self._wall,
+            'cpu_s': time.process_time() - self._cpu,
+            'process_peak_rss_kib': get_peak_rss(),
+            'stages': self.stages,
+        }
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as file:
+            json.dump(self.get_report(), file, indent=2)
+
+
+# Recorder of `stage`, set by `recording`
+_recorder: Recorder = None
+
+@contextlib.contextmanager
+def recording(recorder: Recorder) -> Iterator[Recorder]:
+    """Makes `stage` record to `recorder` in the `with` block"""
+    global _recorder
+    outer = _recorder
+    _recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _recorder = outer
+
+
+def stage(name: str) -> contextlib.AbstractContextManager:
+    """Records the `with` block as a stage of the current recorder, if any, see `recording`"""
+    return _recorder.stage(name) if _recorder else contextlib.nullcontext()
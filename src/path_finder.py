@@ -1,10 +1,23 @@
-import heapq
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import functools
+import hashlib
+import json
 import math
+from multiprocessing import shared_memory
+import numpy as np
+import os
 import pcbnew
 from pcbnew import wxPoint
-from typing import List, Tuple, Iterator
+import struct
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple, Union
+import zlib
 
+from route_cache import RouteCache
 import utils
+import vector
 
 DIAGONAL = math.sqrt(2)
 RECT_SHAPES = {
@@ -13,101 +26,432 @@ RECT_SHAPES = {
     pcbnew.PAD_SHAPE_CHAMFERED_RECT,
 }
 
-# Suppress warnings at type hinting
-class Graph:
-    pass
+# Path cells dilated at a time, keeps the dilated window small on long paths
+PATH_CHUNK = 64
+GENERATION_MAX = 0xFFFFFFFF
+NEGOTIATION_ITERATIONS = 8
+# Coarse cells around the coarse path that are part of the corridor of a coarse-to-fine search
+CORRIDOR_RADIUS = 1
+# Manhattan distance in cells above which the 'auto' engine searches from both ends
+BIDIRECTIONAL_DISTANCE = 100
+# Cost of moving between planes, in straight steps
+VIA_COST = 20
+# Modes of `smooth_path`
+SMOOTHING = ('octilinear', 'any')
+# (x, y, size, is_rect) of a pad including its clearance, in grid unit
+PadShape = Tuple[int, int, int, bool]
+# (touched, expanded, pushes) of a search
+Counters = Tuple[int, int, int]
+# A stamp recorded in a wall layer: the slices of the graph, the mask over them (None if
+# the slices are covered), and +1 or -1 for an added or removed wall
+Stamp = Tuple[Tuple[slice, slice], np.ndarray, int]
+DIRECTIONS = [
+    # W E N S NW SE SW NE
+    (-1, 0), (1, 0), (0, -1), (0, 1),
+    (-1, -1), (1, 1), (-1, 1), (1, -1),
+]
+
+
+def _edge_classes(lo: int, hi: int) -> List[int]:
+    """Classifies each coordinate in [0, hi] by the edges it touches.
+    Bit 0 is set at `lo` and bit 1 is set at `hi`."""
+    return [int(i == lo) | (int(i == hi) << 1) for i in range(hi + 1)]
+
+
+class Net(NamedTuple):
+    """A pad-to-pad connection in grid unit"""
+    src: int
+    dst: int
+    src_pad: PadShape
+    dst_pad: PadShape
+    clearance_x: int
+    clearance_y: int
+
+
+class Route(NamedTuple):
+    """A routed net: the cells of its path, the cells at the vertices of its trace, the search
+    counters, the time spent finding the route and the cells of each plane its searches covered"""
+    path: List[int]
+    vertices: List[int]
+    counters: Counters
+    seconds: float = 0.0
+    area: int = 0
+
+
+@functools.lru_cache(maxsize=None)
+def diamond_stencil(w: int, h: int) -> np.ndarray:
+    i = np.arange(-w, w + 1)[:, None]
+    j = np.arange(-h, h + 1)[None, :]
+    stencil = h * np.abs(i) + w * np.abs(j) <= w * h
+    stencil.setflags(write=False)
+    return stencil
+
+
+@functools.lru_cache(maxsize=None)
+def square_stencil(r: int) -> np.ndarray:
+    stencil = np.ones((2 * r + 1, 2 * r + 1), dtype=np.bool_)
+    stencil.setflags(write=False)
+    return stencil
+
+
+@functools.lru_cache(maxsize=None)
+def oct_stencil(r: int) -> np.ndarray:
+    i = np.arange(-r, r + 1)[:, None]
+    j = np.arange(-r, r + 1)[None, :]
+    stencil = np.abs(i) + np.abs(j) < DIAGONAL * r
+    stencil.setflags(write=False)
+    return stencil
+
+
+def _distance_pass(d: np.ndarray, weight: int, axis: int) -> np.ndarray:
+    """Weighted 1D L1 distance transform of `d` along `axis`"""
+    shape = (-1, 1) if axis == 0 else (1, -1)
+    ramp = (weight * np.arange(d.shape[axis])).reshape(shape)
+    forward = np.minimum.accumulate(d - ramp, axis=axis) + ramp
+    backward = np.flip(np.minimum.accumulate(np.flip(d + ramp, axis), axis=axis), axis) - ramp
+    return np.minimum(forward, backward)
+
+
+def dilate_diamond(xs: np.ndarray, ys: np.ndarray, w: int, h: int) -> Tuple[int, int, np.ndarray]:
+    """Dilates the cells (xs, ys) by `diamond_stencil(w, h)`.
+
+    The diamond is the ball `h * |dx| + w * |dy| <= w * h`, so the dilation is a threshold
+    of the weighted L1 distance transform, which is separable into one pass per axis.
+
+    Returns:
+        The top-left corner of the mask and the mask.
+    """
+    x, y = int(xs.min()) - w, int(ys.min()) - h
+    size = (int(xs.max()) - x + w + 1, int(ys.max()) - y + h + 1)
+    d = np.full(size, w * h + 1, dtype=np.int32)
+    d[xs - x, ys - y] = 0
+    d = _distance_pass(d, h, 0)
+    d = _distance_pass(d, w, 1)
+    return (x, y, d <= w * h)
 
-class Node:
 
-    def __init__(self, parent: Graph, x: int, y: int):
-        self.parent: Graph = parent
-        self.x: int = x
-        self.y: int = y
-        self.cost_so_far: float = float('inf')
-        self.previous: Node = None
-        self.is_wall: bool = False
+class Graph:
+    """An 8-connected grid graph, with `depth` stacked planes connected by vias.
 
-    def init_neighbors(self) -> None:
-        # W E N S NW SE SW NE
-        direction = [
-            (self.x - 1, self.y), (self.x + 1, self.y), (self.x, self.y - 1), (self.x, self.y + 1),
-            (self.x - 1, self.y - 1), (self.x + 1, self.y + 1), (self.x - 1, self.y + 1), (self.x + 1, self.y - 1),
-        ]
-        self.adj: List[Node] = [self.parent.node[dir[0]][dir[1]] for dir in direction if self.parent.in_bounds(dir[0], dir[1])]
+    Cells are addressed by integer indices, the cell (x, y) of plane z has index
+    `(z * width + x) * height + y`. Walls, costs and predecessors are kept in flat typed arrays
+    indexed by cell, and neighbors are computed from index offsets. Walls are stamped on the
+    plane selected with `on_plane`, plane 0 by default.
 
-    def get_neighbors(self):
-        return [n for n in self.adj if (not n.is_wall or self.is_wall)]
+    Walls are reference counted: adding a wall increments the count of its cells and removing
+    it decrements them, skipping cells without walls, a cell is a wall while its count is positive.
+    So removing a wall never erases other walls over it, while `clear_wall_rect` erases all walls
+    of a rectangle. Walls can be grouped in named layers, see `wall_layer`.
+    """
 
-    def __eq__(self, other):
-        return self.cost_so_far == other.cost_so_far
+    def __init__(self, width: int, height: int, depth: int = 1):
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.plane_cells = width * height
+        self.cells = depth * self.plane_cells
+        self.plane = 0
+        self.is_wall = array('B', bytes(self.cells))
+        self.wall_count = np.zeros((depth * width, height), dtype=np.int16)
+        self.wall_layers: Dict[str, List[Stamp]] = {}
+        # Stamps of the layer being recorded
+        self._recording: List[Stamp] = None
+        # Search state, `cost_so_far` and `previous` of a cell are only valid
+        # if its `visited` stamp equals the current generation
+        self.cost_so_far = array('i', bytes(4 * self.cells))
+        self.previous = array('i', bytes(4 * self.cells))
+        self.visited = array('I', bytes(4 * self.cells))
+        # A cell is expanded at most once, when its `closed` stamp is set to the current generation
+        self.closed = array('I', bytes(4 * self.cells))
+        # The same for searches from the destination, where `next` links a cell to the destination
+        self.cost_to_go = array('i', bytes(4 * self.cells))
+        self.next = array('i', bytes(4 * self.cells))
+        self.visited_reverse = array('I', bytes(4 * self.cells))
+        self.closed_reverse = array('I', bytes(4 * self.cells))
+        self.generation = 1
+        # Extra cost of entering each cell, only read by `congestion_search`
+        self.penalty: array = None
+        # Number of searches that expanded each cell, accumulated by `find_path` unless None
+        self.heat: np.ndarray = None
+        # Counters of the last search
+        self.touched = 0
+        self.expanded = 0
+        self.pushes = 0
+        # NumPy views sharing memory with the arrays above
+        # The planes are stacked along x
+        self.walls = np.frombuffer(self.is_wall, dtype=np.bool_).reshape(depth * width, height)
+        self._stamp_views = [np.frombuffer(a, dtype=np.uint32) for a in (self.visited, self.closed, self.visited_reverse, self.closed_reverse)]
+        self._init_moves()
+
+    def _init_moves(self) -> None:
+        # Valid (offset, cost) pairs for every combination of z, x and y edge classes
+        self.moves: List[List[Tuple[int, int]]] = []
+        for cls in range(64):
+            z_cls, x_cls, y_cls = cls >> 4, (cls >> 2) & 3, cls & 3
+            moves = []
+            for dx, dy in DIRECTIONS:
+                if (dx < 0 and x_cls & 1) or (dx > 0 and x_cls & 2):
+                    continue
+                if (dy < 0 and y_cls & 1) or (dy > 0 and y_cls & 2):
+                    continue
+                moves.append((dx * self.height + dy, 2 if dx and dy else 1))
+            if not z_cls & 1:
+                moves.append((-self.plane_cells, VIA_COST))
+            if not z_cls & 2:
+                moves.append((self.plane_cells, VIA_COST))
+            self.moves.append(moves)
+        # The x of each column of the stacked planes
+        self.column = list(range(self.width)) * self.depth
+        self.window = (0, self.width - 1, 0, self.height - 1)
+        (self.x_class, self.y_class) = self.edge_classes(self.window)
+
+    def edge_classes(self, window: Tuple[int, int, int, int]) -> Tuple[List[int], List[int]]:
+        """Returns lookup tables of the edge class of each column of the stacked planes and each y,
+        for moves within `window` on every plane"""
+        (x1, x2, y1, y2) = window
+        x_class = [c << 2 for c in _edge_classes(x1, x2)] + [0] * (self.width - 1 - x2)
+        columns = []
+        for z in _edge_classes(0, self.depth - 1):
+            columns.extend(c | z << 4 for c in x_class)
+        return (columns, _edge_classes(y1, y2))
+
+    def bounding_window(self, src: int, dst: int, margin: int) -> Tuple[int, int, int, int]:
+        """Returns the bounding box of `src` and `dst` expanded by `margin`, clipped to the graph"""
+        (x1, y1), (x2, y2) = self.coords(src), self.coords(dst)
+        return (
+            max(min(x1, x2) - margin, 0),
+            min(max(x1, x2) + margin, self.width - 1),
+            max(min(y1, y2) - margin, 0),
+            min(max(y1, y2) + margin, self.height - 1),
+        )
+
+    def index(self, x: int, y: int, z: int = 0) -> int:
+        return (z * self.width + x) * self.height + y
+
+    def coords(self, cell: int) -> Tuple[int, int]:
+        """Returns the (x, y) of `cell` on its plane"""
+        return divmod(cell % self.plane_cells, self.height)
+
+    def get_plane(self, cell: int) -> int:
+        return cell // self.plane_cells
 
-    def __lt__(self, other):
-        return self.cost_so_far < other.cost_so_far
+    def in_bounds(self, x: int, y: int) -> bool:
+        return (0 <= x < self.width) and (0 <= y < self.height)
 
+    def cost(self, start: int, end: int) -> float:
+        if self.get_plane(start) != self.get_plane(end):
+            return VIA_COST
+        (x1, y1), (x2, y2) = self.coords(start), self.coords(end)
+        return 2 if (x1 != x2) and (y1 != y2) else 1
 
-class Graph:
+    def get_neighbors(self, cell: int) -> List[int]:
+        (x, y) = divmod(cell, self.height)
+        moves = self.moves[self.x_class[x] | self.y_class[y]]
+        is_wall = self.is_wall
+        return [cell + offset for offset, _ in moves if (not is_wall[cell + offset] or is_wall[cell])]
 
-    def __init__(self, width: int, height: int):
-        self.width = width
-        self.height = height
-        self.node: List[Node] = [[Node(self, x, y) for y in range(height)] for x in range(width)]
+    def reached(self, cell: int) -> bool:
+        return self.visited[cell] == self.generation
 
-        for n in self._all_nodes():
-            n.init_neighbors()
+    def get_cost(self, cell: int) -> float:
+        return self.cost_so_far[cell] if self.visited[cell] == self.generation else math.inf
 
-    def _all_nodes(self) -> Iterator[Node]:
-        for col in self.node:
-            for n in col:
-                yield n
+    def get_previous(self, cell: int) -> int:
+        return self.previous[cell] if self.visited[cell] == self.generation else -1
 
-    def in_bounds(self, x: int, y: int) -> bool:
-        return (0 <= x < self.width) and (0 <= y < self.height)
-
-    def cost(self, start: Node, end: Node) -> float:
-        return 2 if (start.x != end.x) and (start.y != end.y) else 1
+    def visit(self, cell: int, cost: int, previous: int) -> None:
+        if self.visited[cell] != self.generation:
+            self.visited[cell] = self.generation
+            self.touched += 1
+        self.cost_so_far[cell] = cost
+        self.previous[cell] = previous
 
     def reset_nodes(self) -> None:
-        for n in self._all_nodes():
-            n.cost_so_far = float('inf')
-            n.previous = None
+        """Invalidates the search state in O(1) by starting a new generation"""
+        if self.generation == GENERATION_MAX:
+            for view in self._stamp_views:
+                view.fill(0)
+            self.generation = 0
+        self.generation += 1
+        self.touched = 0
+        self.expanded = 0
+        self.pushes = 0
+
+    def record_heat(self) -> None:
+        """Adds the cells expanded by the current search to `heat`, if it is recorded"""
+        if self.heat is not None:
+            (_, closed, _, closed_reverse) = self._stamp_views
+            expanded = (closed == self.generation) | (closed_reverse == self.generation)
+            self.heat += expanded.reshape(self.heat.shape)
+
+    def get_counters(self) -> Counters:
+        return (self.touched, self.expanded, self.pushes)
+
+    def set_counters(self, counters: Counters) -> None:
+        (self.touched, self.expanded, self.pushes) = counters
 
     def reset_walls(self) -> None:
-        for n in self._all_nodes():
-            n.is_wall = False
-
-    def set_wall_rect(self, x1: int, x2: int, y1: int, y2: int, state: bool) -> None:
+        self.walls.fill(False)
+        self.wall_count.fill(0)
+        self.wall_layers.clear()
+
+    @contextlib.contextmanager
+    def on_plane(self, z: int) -> Iterator[None]:
+        """Stamps walls on the plane `z` in the `with` block"""
+        outer = self.plane
+        self.plane = z
+        try:
+            yield
+        finally:
+            self.plane = outer
+
+    @contextlib.contextmanager
+    def wall_layer(self, name: str) -> Iterator[None]:
+        """Records the walls added and removed in the `with` block in the layer `name`,
+        so that `remove_wall_layer` can undo them"""
+        outer = self._recording
+        self._recording = self.wall_layers.setdefault(name, [])
+        try:
+            yield
+        finally:
+            self._recording = outer
+
+    def remove_wall_layer(self, name: str) -> None:
+        """Undoes the walls recorded in the layer `name`, in time proportional to their size"""
+        for (window, mask, delta) in reversed(self.wall_layers.pop(name, [])):
+            self._count(window, mask, -delta)
+
+    def _count(self, window: Tuple[slice, slice], mask: np.ndarray, delta: int) -> np.ndarray:
+        """Adds `delta` to the wall count of the cells of `mask` over `window`, of all its cells if
+        `mask` is None. Removing walls skips the cells with fewer walls, so that counts never go below
+        zero and removing walls that were never added doesn't cancel walls added later.
+
+        Returns:
+            The mask of the cells changed, None if all cells of `window` changed.
+        """
+        counts = self.wall_count[window]
+        if delta < 0:
+            kept = counts >= -delta
+            mask = kept if mask is None else mask & kept
+        if mask is None:
+            counts += delta
+        else:
+            counts[mask] += delta
+        self.walls[window] = counts > 0
+        return mask
+
+    def _apply(self, window: Tuple[slice, slice], mask: np.ndarray, state: bool) -> None:
+        delta = 1 if state else -1
+        # Record the cells actually changed, so that undoing the layer restores the counts exactly
+        mask = self._count(window, mask, delta)
+        if self._recording is not None:
+            self._recording.append((window, mask, delta))
+
+    def _stamp(self, x: int, y: int, stencil: np.ndarray, state: bool) -> None:
+        """Stamps `stencil` centered at (x, y), clipped to the graph"""
+        (rx, ry) = (stencil.shape[0] // 2, stencil.shape[1] // 2)
+        self._stamp_at(x - rx, y - ry, stencil, state)
+
+    def clip(self, x: int, y: int, mask: np.ndarray) -> Tuple[Tuple[slice, slice], np.ndarray]:
+        """Clips `mask` with its top-left corner at (x, y) to the current plane.
+
+        Returns:
+            The slices of `walls` covered by the clipped mask and the clipped mask, or None
+            if the mask is outside the plane.
+        """
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + mask.shape[0], self.width), min(y + mask.shape[1], self.height)
+        if x1 >= x2 or y1 >= y2:
+            return None
+        offset = self.plane * self.width
+        return ((slice(offset + x1, offset + x2), slice(y1, y2)), mask[x1 - x:x2 - x, y1 - y:y2 - y])
+
+    def _stamp_at(self, x: int, y: int, mask: np.ndarray, state: bool) -> None:
+        """Stamps `mask` with its top-left corner at (x, y), clipped to the graph"""
+        clipped = self.clip(x, y, mask)
+        if not clipped:
+            return
+        (window, mask) = clipped
+        self._apply(window, mask, state)
+
+    def get_rect_window(self, x1: int, x2: int, y1: int, y2: int) -> Tuple[slice, slice]:
+        """Returns the slices of `walls` covered by the rectangle with corners (x1, y1) and (x2, y2)
+        on the current plane, or None if the rectangle is outside the plane"""
         if x1 > x2:
             x1, x2 = x2, x1
         if y1 > y2:
             y1, y2 = y2, y1
-        for x in range(x1, x2 + 1):
-            for y in range(y1, y2 + 1):
-                if self.in_bounds(x, y):
-                    self.node[x][y].is_wall = state
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2 + 1, self.width), min(y2 + 1, self.height)
+        offset = self.plane * self.width
+        if x1 >= x2 or y1 >= y2:
+            return None
+        return (slice(offset + x1, offset + x2), slice(y1, y2))
+
+    def set_wall_rect(self, x1: int, x2: int, y1: int, y2: int, state: bool) -> None:
+        window = self.get_rect_window(x1, x2, y1, y2)
+        if window:
+            self._apply(window, None, state)
+
+    def clear_wall_rect(self, x1: int, x2: int, y1: int, y2: int) -> None:
+        """Removes all walls of the rectangle, however many times they were added. Unlike removing
+        walls, clearing isn't recorded in wall layers."""
+        window = self.get_rect_window(x1, x2, y1, y2)
+        if window:
+            self.wall_count[window] = 0
+            self.walls[window] = False
 
     def set_wall_square(self, x: int, y: int, size: int, state: bool) -> None:
         r = int(size / 2)
         self.set_wall_rect(int(x - r), int(x + r), int(y - r), int(y + r), state)
 
     def set_wall_diamond(self, x: int, y: int, w: int, h: int, state: bool) -> None:
-        for i in range(-w, w + 1):
-            for j in range(-h, h + 1):
-                if h * abs(i) + w * abs(j) <= w * h:
-                    _x = x + i
-                    _y = y + j
-                    if self.in_bounds(_x, _y):
-                        self.node[_x][_y].is_wall = state
+        self._stamp(x, y, diamond_stencil(w, h), state)
 
     def set_wall_oct(self, x: int, y: int, size: int, state: bool) -> None:
-        r = int(size / 2)
-        for i in range(-r, r + 1):
-            for j in range(-r, r + 1):
-                if abs(i) + abs(j) < DIAGONAL * r:
-                    _x = x + i
-                    _y = y + j
-                    if self.in_bounds(_x, _y):
-                        self.node[_x][_y].is_wall = state
-                        
+        self._stamp(x, y, oct_stencil(int(size / 2)), state)
+
+    def split_planes(self, path: List[int]) -> List[Tuple[int, np.ndarray]]:
+        """Returns the planes `path` goes through, with the cells of `path` on each of them"""
+        cells = np.asarray(path, dtype=np.int64)
+        planes = cells // self.plane_cells
+        return [(int(z), cells[planes == z]) for z in np.unique(planes)]
+
+    def get_path_masks(self, path: List[int], w: int, h: int) -> List[Tuple[int, int, np.ndarray]]:
+        """Dilates the cells of `path`, which must lie on one plane, by `diamond_stencil(w, h)`.
+
+        Returns:
+            Masks with their top-left corners on the plane, which together cover the dilated path.
+        """
+        (xs, ys) = np.divmod(np.asarray(path, dtype=np.int64) % self.plane_cells, self.height)
+        if w <= 0 or h <= 0:
+            # Degenerate diamonds are lines, stamp them one by one
+            stencil = diamond_stencil(w, h)
+            return [(x - w, y - h, stencil) for x, y in zip(xs.tolist(), ys.tolist())]
+        return [dilate_diamond(xs[i:i + PATH_CHUNK], ys[i:i + PATH_CHUNK], w, h) for i in range(0, len(path), PATH_CHUNK)]
+
+    def get_path_footprints(self, path: List[int], w: int, h: int) -> List[Tuple[Tuple[slice, slice], np.ndarray]]:
+        """Returns the cells covered by `path` dilated by `diamond_stencil(w, h)`, as the slices of
+        `walls` they lie in and a mask over the slices, for each plane of the path"""
+        footprints = []
+        for (z, cells) in self.split_planes(path):
+            (xs, ys) = np.divmod(cells % self.plane_cells, self.height)
+            (x, y) = (int(xs.min()) - w, int(ys.min()) - h)
+            footprint = np.zeros((int(xs.max()) - x + w + 1, int(ys.max()) - y + h + 1), dtype=np.bool_)
+            for (mx, my, mask) in self.get_path_masks(cells, w, h):
+                footprint[mx - x:mx - x + mask.shape[0], my - y:my - y + mask.shape[1]] |= mask
+            with self.on_plane(z):
+                footprints.append(self.clip(x, y, footprint))
+        return footprints
+
+    def set_wall_path(self, path: List[int], w: int, h: int, state: bool) -> None:
+        """Stamps a diamond at every cell of `path`, i.e. dilates the path by the diamond,
+        on each plane of the path"""
+        for (z, cells) in self.split_planes(path):
+            with self.on_plane(z):
+                for (x, y, mask) in self.get_path_masks(cells, w, h):
+                    self._stamp_at(x, y, mask, state)
+
     def add_wall_rect(self, x1: int, x2: int, y1: int, y2: int) -> None:
         self.set_wall_rect(x1, x2, y1, y2, True)
 
@@ -132,10 +476,73 @@ class Graph:
     def sub_wall_oct(self, x: int, y: int, size: int) -> None:
         self.set_wall_oct(x, y, size, False)
 
+    def set_wall_pad(self, pad: PadShape, state: bool) -> None:
+        (x, y, size, is_rect) = pad
+        if is_rect:
+            self.set_wall_square(x, y, size, state)
+        else:
+            self.set_wall_oct(x, y, size, state)
+
+    def get_pad_region(self, pad: PadShape) -> Tuple[Tuple[slice, slice], np.ndarray]:
+        """Returns the cells of `pad` like `clip`"""
+        (x, y, size, is_rect) = pad
+        r = int(size / 2)
+        return self.clip(x - r, y - r, square_stencil(r) if is_rect else oct_stencil(r))
+
+    def open_pad(self, pad: PadShape, z: int = 0) -> None:
+        """Clears all walls over `pad` on the plane `z` without changing their counts, until `close_pad`"""
+        with self.on_plane(z):
+            region = self.get_pad_region(pad)
+        if region:
+            (window, mask) = region
+            self.walls[window] &= ~mask
+
+    def close_pad(self, pad: PadShape, z: int = 0) -> None:
+        """Restores the walls over `pad` on the plane `z` from their counts"""
+        with self.on_plane(z):
+            region = self.get_pad_region(pad)
+        if region:
+            (window, _) = region
+            self.walls[window] = self.wall_count[window] > 0
+
+    def add_wall_pad(self, pad: PadShape) -> None:
+        self.set_wall_pad(pad, True)
+
+    def sub_wall_pad(self, pad: PadShape) -> None:
+        self.set_wall_pad(pad, False)
+
+    def add_wall_path(self, path: List[int], w: int, h: int) -> None:
+        self.set_wall_path(path, w, h, True)
+
+    def sub_wall_path(self, path: List[int], w: int, h: int) -> None:
+        self.set_wall_path(path, w, h, False)
+
 
 class Grid:
 
-    def __init__(self, board: pcbnew.BOARD, x1: int, x2: int, y1: int, y2: int, size: int):
+    def __init__(
+            self,
+            board: Union[pcbnew.BOARD, utils.BoardBuilder],
+            x1: int,
+            x2: int,
+            y1: int,
+            y2: int,
+            size: int,
+            margin: int = None,
+            engine: str = 'astar',
+            coarse_size: int = None,
+            layers: List[int] = None,
+            smooth: str = None,
+            cache: RouteCache = None,
+        ):
+        """`margin` enables windowed searches around each pad pair, `engine` selects the search and
+        `coarse_size` enables coarse-to-fine searches with coarse cells of about this size, see `find_path`.
+
+        If copper `layers` are given, each of them is a plane of the graph and nets may change layers
+        through vias. Otherwise, the graph has one plane and nets are routed on the layer they are given.
+        `smooth` selects one of the `SMOOTHING` modes of traces, see `smooth_path`. Routes are replayed
+        from `cache` where the walls around them are unchanged, see `route_net`.
+        """
         self.board = board
         if x1 > x2:
             x1, x2 = x2, x1
@@ -149,7 +556,15 @@ class Grid:
         # In grid unit
         self.cols: int = int(self.width / size)
         self.rows: int = int(self.height / size)
-        self.graph = Graph(self.cols, self.rows)
+        self.margin: int = None if margin is None else int(margin / size)
+        self.engine: str = engine
+        self.coarse: int = None if coarse_size is None else round(coarse_size / size)
+        self.layers: List[int] = layers
+        self.smooth: str = smooth
+        self.cache: RouteCache = cache
+        # Statistics of each routed net, see `save_stats`
+        self.stats: List[Dict[str, Any]] = []
+        self.graph = Graph(self.cols, self.rows, len(layers) if layers else 1)
 
     def grid_to_pcb(self, x: int, y: int) -> wxPoint:
         return self.origin + wxPoint(x * self.size, y * self.size)
@@ -158,17 +573,36 @@ class Grid:
         rel_pos = pos - self.origin
         return (int(rel_pos.x / self.size), int(rel_pos.y / self.size))
 
-    def get_node(self, pos: wxPoint) -> Node:
+    def get_cell(self, pos: wxPoint, z: int = 0) -> int:
         (x, y) = self.pcb_to_grid(pos)
-        return self.graph.node[x][y]
+        return self.graph.index(x, y, z)
 
-    def set_wall_pad(self, pad: pcbnew.PAD, clearance: int, state: bool) -> None:
+    def get_copper_layer(self, z: int, layer: int) -> int:
+        """Returns the copper layer of the plane `z`, which is `layer` without `layers`"""
+        return self.layers[z] if self.layers else layer
+
+    def get_pad_planes(self, pad: pcbnew.PAD) -> List[int]:
+        if not self.layers:
+            return [0]
+        return [z for z, layer in enumerate(self.layers) if pad.IsOnLayer(layer)]
+
+    def get_pad_plane(self, pad: pcbnew.PAD, layer: int) -> int:
+        """Returns the plane of `layer` if `pad` is on it, otherwise the first plane `pad` is on"""
+        planes = self.get_pad_planes(pad)
+        if self.layers and layer in self.layers and self.layers.index(layer) in planes:
+            return self.layers.index(layer)
+        return planes[0] if planes else 0
+
+    def get_pad_shape(self, pad: pcbnew.PAD, clearance: int) -> PadShape:
         (x, y) = self.pcb_to_grid(pad.GetPosition())
         size = int((pad.GetSizeX() + 2 * clearance) / self.size)
-        if pad.GetShape() in RECT_SHAPES:
-            self.graph.set_wall_square(x, y, size, state)
-        else:
-            self.graph.set_wall_oct(x, y, size, state)
+        return (x, y, size, pad.GetShape() in RECT_SHAPES)
+
+    def set_wall_pad(self, pad: pcbnew.PAD, clearance: int, state: bool) -> None:
+        shape = self.get_pad_shape(pad, clearance)
+        for z in self.get_pad_planes(pad):
+            with self.graph.on_plane(z):
+                self.graph.set_wall_pad(shape, state)
 
     def add_wall_pad(self, pad: pcbnew.PAD, clearance: int) -> None:
         self.set_wall_pad(pad, clearance, True)
@@ -176,11 +610,74 @@ class Grid:
     def sub_wall_pad(self, pad: pcbnew.PAD, clearance: int) -> None:
         self.set_wall_pad(pad, clearance, False)
 
-    def add_wall_path(self, path: List[Node], width: int, height: int) -> None:
+    def add_wall_path(self, path: List[int], width: int, height: int) -> None:
         w = int(width / self.size)
         h = int(height / self.size)
-        for n in path:
-            self.graph.add_wall_diamond(n.x, n.y, w, h)
+        self.graph.add_wall_path(path, w, h)
+
+    def get_trace_layer(self, layer: int) -> str:
+        """Returns the wall layer of the traces routed on the copper `layer`"""
+        return f"traces:{layer}"
+
+    def get_net(
+            self,
+            src_pad: pcbnew.PAD,
+            dst_pad: pcbnew.PAD,
+            pad_clearance: int,
+            track_clearance_x: int,
+            track_clearance_y: int,
+            layer: int = None,
+        ) -> Net:
+        """The net starts and ends on `layer` where the pads are on it, see `get_pad_plane`"""
+
+        return Net(
+            self.get_cell(src_pad.GetPosition(), self.get_pad_plane(src_pad, layer)),
+            self.get_cell(dst_pad.GetPosition(), self.get_pad_plane(dst_pad, layer)),
+            self.get_pad_shape(src_pad, pad_clearance),
+            self.get_pad_shape(dst_pad, pad_clearance),
+            int(track_clearance_x / self.size),
+            int(track_clearance_y / self.size),
+        )
+
+    def _create_trace(self, src_pad: pcbnew.PAD, dst_pad: pcbnew.PAD, route: Route, width: int, layer: int) -> List[wxPoint]:
+        vertices = route.vertices
+        trace = [self.grid_to_pcb(*self.graph.coords(c)) for c in vertices]
+        trace[0], trace[-1] = src_pad.GetPosition(), dst_pad.GetPosition()
+        self._record_stats(src_pad, dst_pad, route, trace, layer)
+
+        # Draw the trace one plane at a time, with a via at each change of plane
+        start = 0
+        for i in range(1, len(vertices)):
+            z = self.graph.get_plane(vertices[start])
+            if self.graph.get_plane(vertices[i]) != z:
+                utils.polyline(self.board, trace[start:i], width, self.get_copper_layer(z, layer))
+                utils.via(self.board, trace[i], width, pcbnew.F_Cu, pcbnew.B_Cu)
+                start = i
+        utils.polyline(self.board, trace[start:], width, self.get_copper_layer(self.graph.get_plane(vertices[start]), layer))
+        return trace
+
+    def _record_stats(self, src_pad: pcbnew.PAD, dst_pad: pcbnew.PAD, route: Route, trace: List[wxPoint], layer: int) -> None:
+        (touched, expanded, pushes) = route.counters
+        net = f"{src_pad.GetParent().GetReference()}:{src_pad.GetName()} -> {dst_pad.GetParent().GetReference()}:{dst_pad.GetName()}"
+        length = pcbnew.ToMM(sum(vector.dot_to_dot(trace[i], trace[i + 1]) for i in range(len(trace) - 1)))
+        self.stats.append({
+            'net': net,
+            'layer': layer,
+            'touched': touched,
+            'expanded': expanded,
+            'pushes': pushes,
+            'seconds': route.seconds,
+            'area': route.area,
+            'path_cells': len(route.path),
+            'vertices': len(route.vertices),
+            'length_mm': length,
+        })
+        print(f"{net} ({touched} cells touched, {expanded} expanded, {pushes} pushes, {route.seconds * 1000:.1f} ms, {len(route.vertices)} vertices, {length:.1f} mm)")
+
+    def save_stats(self, path: str) -> None:
+        """Writes the statistics of the routed nets as JSON"""
+        with open(path, 'w') as file:
+            json.dump(self.stats, file, indent=2)
 
     def route_pad_to_pad(
             self,
@@ -193,84 +690,550 @@ class Grid:
             track_clearance_y: int,
         ) -> List[wxPoint]:
 
-        self.graph.reset_nodes()
-        print(f"{src_pad.GetParent().GetReference()}:{src_pad.GetName()} -> {dst_pad.GetParent().GetReference()}:{dst_pad.GetName()}")
-        src_pos = src_pad.GetPosition()
-        dst_pos = dst_pad.GetPosition()
-        src = self.get_node(src_pos)
-        dst = self.get_node(dst_pos)
-
-        self.sub_wall_pad(src_pad, pad_clearance)
-        self.sub_wall_pad(dst_pad, pad_clearance)
-        path = find_path(self.graph, src, dst)
-        self.add_wall_pad(src_pad, pad_clearance)
-        self.add_wall_pad(dst_pad, pad_clearance)
-
-        self.add_wall_path(path, track_clearance_x, track_clearance_y)
-
-        vertices = get_vertices(path)
-        trace = [self.grid_to_pcb(p.x, p.y) for p in vertices]
-        trace[0], trace[-1] = src_pos, dst_pos
-        utils.polyline(self.board, trace, width, layer)
-        return trace
-
+        net = self.get_net(src_pad, dst_pad, pad_clearance, track_clearance_x, track_clearance_y, layer)
+        with self.graph.wall_layer(self.get_trace_layer(layer)):
+            route = route_net(self.graph, net, self.margin, self.engine, self.coarse, self.smooth, self.cache)
+        return self._create_trace(src_pad, dst_pad, route, width, layer)
 
-class PriorityQueue:
+    def route_batch(
+            self,
+            pads: List[Tuple[pcbnew.PAD, pcbnew.PAD]],
+            width: int,
+            layer: int,
+            pad_clearance: int,
+            track_clearance_x: int,
+            track_clearance_y: int,
+            workers: int = None,
+        ) -> List[List[wxPoint]]:
+        """Routes pad pairs like `route_pad_to_pad`, nets in independent regions are routed in parallel.
+        See `route_nets`."""
 
-    def __init__(self):
-        self.elements: List[Tuple[float, Node]] = []
+        nets = [self.get_net(src_pad, dst_pad, pad_clearance, track_clearance_x, track_clearance_y, layer) for src_pad, dst_pad in pads]
+        with self.graph.wall_layer(self.get_trace_layer(layer)):
+            results = route_nets(self.graph, nets, self.margin, self.engine, workers, self.coarse, self.smooth, self.cache)
+        return [self._create_trace(src_pad, dst_pad, route, width, layer) for (src_pad, dst_pad), route in zip(pads, results)]
 
-    def empty(self) -> bool:
-        return not bool(self.elements)
+    def route_negotiated(
+            self,
+            pads: List[Tuple[pcbnew.PAD, pcbnew.PAD]],
+            width: int,
+            layer: int,
+            pad_clearance: int,
+            track_clearance_x: int,
+            track_clearance_y: int,
+            iterations: int = NEGOTIATION_ITERATIONS,
+        ) -> List[List[wxPoint]]:
+        """Routes pad pairs like `route_pad_to_pad`, but negotiates congestion between them instead
+        of routing them greedily in order. See `negotiate_nets`. Negotiated routes aren't cached, since
+        each of them depends on all the others."""
 
-    def push(self, item: Node, priority: float) -> None:
-        heapq.heappush(self.elements, (priority, item))
+        nets = [self.get_net(src_pad, dst_pad, pad_clearance, track_clearance_x, track_clearance_y, layer) for src_pad, dst_pad in pads]
+        with self.graph.wall_layer(self.get_trace_layer(layer)):
+            results = negotiate_nets(self.graph, nets, self.margin, iterations, self.coarse, self.smooth)
+        return [self._create_trace(src_pad, dst_pad, route, width, layer) for (src_pad, dst_pad), route in zip(pads, results)]
 
-    def pop(self) -> Node:
-        return heapq.heappop(self.elements)[1]
 
+class BucketQueue:
+    """Dial's priority queue for small non-negative integer priorities.
 
-def heuristic(src: Node, dst: Node) -> float:
-    dx = abs(src.x - dst.x)
-    dy = abs(src.y - dst.y)
-    return dx + dy + (DIAGONAL - 2) * min(dx, dy)
+    Pushes and pops are O(1) as long as the popped priorities never decrease, which holds for
+    A* with a consistent heuristic. Items of the same priority are popped last in, first out.
+    """
 
+    def __init__(self):
+        self.buckets: List[List[int]] = []
+        self.cursor = 0
+        self.size = 0
 
-def a_star_search(graph: Graph, src: Node, dst: Node) -> None:
-    frontier = PriorityQueue()
-    frontier.push(src, 0)
-    src.cost_so_far = 0
+    def empty(self) -> bool:
+        return self.size == 0
+
+    def push(self, item: int, priority: int) -> None:
+        while len(self.buckets) <= priority:
+            self.buckets.append([])
+        self.buckets[priority].append(item)
+        self.size += 1
+        if priority < self.cursor:
+            self.cursor = priority
+
+    def peek(self) -> int:
+        """Returns the lowest priority in the queue, which must not be empty"""
+        while not self.buckets[self.cursor]:
+            self.cursor += 1
+        return self.cursor
+
+    def pop(self) -> int:
+        self.size -= 1
+        return self.buckets[self.peek()].pop()
+
+
+def heuristic(graph: Graph, src: int, dst: int) -> int:
+    """A diagonal step costs as much as two straight steps, so the Manhattan distance is exact without walls"""
+    (x1, y1), (x2, y2) = graph.coords(src), graph.coords(dst)
+    return abs(x1 - x2) + abs(y1 - y2)
+
+
+def a_star_search(graph: Graph, src: int, dst: int, window: Tuple[int, int, int, int] = None, penalty: array = None) -> None:
+    """Searches from `src` to `dst`. If `window` (x1, x2, y1, y2) is given, the search never leaves it.
+    If `penalty` is given, entering a cell also costs its penalty."""
+    height = graph.height
+    is_wall = graph.is_wall
+    cost_so_far = graph.cost_so_far
+    previous = graph.previous
+    visited = graph.visited
+    closed = graph.closed
+    generation = graph.generation
+    moves = graph.moves
+    column = graph.column
+    (x_class, y_class) = graph.edge_classes(window) if window else (graph.x_class, graph.y_class)
+    (dst_x, dst_y) = graph.coords(dst)
+
+    frontier = BucketQueue()
+    frontier.push(src, heuristic(graph, src, dst))
+    graph.visit(src, 0, -1)
+    (touched, expanded, pushes) = graph.get_counters()
+    pushes += 1
 
     while not frontier.empty():
         current = frontier.pop()
+        if closed[current] == generation:
+            continue
+        closed[current] = generation
+        expanded += 1
         if current == dst:
             break
 
-        for next in current.get_neighbors():
-            new_cost = current.cost_so_far + graph.cost(current, next)
-            if new_cost < next.cost_so_far:
-                next.cost_so_far = new_cost
-                priority = new_cost + heuristic(next, dst)
-                frontier.push(next, priority)
-                next.previous = current
+        (x, y) = divmod(current, height)
+        in_wall = is_wall[current]
+        current_cost = cost_so_far[current]
+        for offset, step in moves[x_class[x] | y_class[y]]:
+            next = current + offset
+            if (is_wall[next] and not in_wall) or closed[next] == generation:
+                continue
+            new_cost = current_cost + step
+            if penalty is not None:
+                new_cost += penalty[next]
+            if visited[next] != generation:
+                visited[next] = generation
+                touched += 1
+            elif new_cost >= cost_so_far[next]:
+                continue
+            cost_so_far[next] = new_cost
+            (next_x, next_y) = divmod(next, height)
+            frontier.push(next, new_cost + abs(column[next_x] - dst_x) + abs(next_y - dst_y))
+            pushes += 1
+            previous[next] = current
+
+    graph.set_counters((touched, expanded, pushes))
+
+
+def congestion_search(graph: Graph, src: int, dst: int, window: Tuple[int, int, int, int] = None) -> None:
+    """Same as `a_star_search`, but entering a cell also costs its `graph.penalty`"""
+    a_star_search(graph, src, dst, window, graph.penalty)
+
+
+def jump_point_search(graph: Graph, src: int, dst: int, window: Tuple[int, int, int, int] = None) -> None:
+    """Jump Point Search on the uniform 8-connected grid.
+
+    Same interface as `a_star_search`, but `previous` links each jump point to the previous one,
+    which lies on a straight or diagonal line from it, see `find_path`. Paths starting or ending
+    inside walls can't be found by jumping, so these searches fall back to A*, as well as searches
+    on graphs with several planes.
+    """
+    if graph.depth > 1 or graph.is_wall[src] or graph.is_wall[dst]:
+        a_star_search(graph, src, dst, window)
+        return
+
+    height = graph.height
+    is_wall = graph.is_wall
+    cost_so_far = graph.cost_so_far
+    previous = graph.previous
+    visited = graph.visited
+    closed = graph.closed
+    generation = graph.generation
+    (x1, x2, y1, y2) = window if window else graph.window
+    (dst_x, dst_y) = graph.coords(dst)
+
+    def blocked(x: int, y: int) -> bool:
+        return not (x1 <= x <= x2 and y1 <= y <= y2) or is_wall[x * height + y]
+
+    def jump_straight(x: int, y: int, dx: int, dy: int) -> Tuple[int, int]:
+        # Scan with index arithmetic, the sides are checked only where they are inside the window
+        cell = x * height + y
+        if dx:
+            offset = dx * height
+            (stop, low, high) = (x2 + 1 if dx > 0 else x1 - 1, y > y1, y < y2)
+            while True:
+                x += dx
+                cell += offset
+                if x == stop or is_wall[cell]:
+                    return None
+                if x == dst_x and y == dst_y:
+                    return (x, y)
+                ahead = x + dx != stop
+                if high and is_wall[cell + 1] and ahead and not is_wall[cell + offset + 1]:
+                    return (x, y)
+                if low and is_wall[cell - 1] and ahead and not is_wall[cell + offset - 1]:
+                    return (x, y)
+        else:
+            (stop, low, high) = (y2 + 1 if dy > 0 else y1 - 1, x > x1, x < x2)
+            while True:
+                y += dy
+                cell += dy
+                if y == stop or is_wall[cell]:
+                    return None
+                if x == dst_x and y == dst_y:
+                    return (x, y)
+                ahead = y + dy != stop
+                if high and is_wall[cell + height] and ahead and not is_wall[cell + height + dy]:
+                    return (x, y)
+                if low and is_wall[cell - height] and ahead and not is_wall[cell - height + dy]:
+                    return (x, y)
+
+    def jump_diagonal(x: int, y: int, dx: int, dy: int) -> Tuple[int, int]:
+        while True:
+            x += dx
+            y += dy
+            if blocked(x, y):
+                return None
+            if x == dst_x and y == dst_y:
+                return (x, y)
+            if (blocked(x - dx, y) and not blocked(x - dx, y + dy)) or (blocked(x, y - dy) and not blocked(x + dx, y - dy)):
+                return (x, y)
+            if jump_straight(x, y, dx, 0) or jump_straight(x, y, 0, dy):
+                return (x, y)
+
+    def successors(x: int, y: int, dx: int, dy: int) -> List[Tuple[int, int]]:
+        if not (dx or dy):
+            return DIRECTIONS
+        if dx and dy:
+            dirs = [(dx, 0), (0, dy), (dx, dy)]
+            if blocked(x - dx, y):
+                dirs.append((-dx, dy))
+            if blocked(x, y - dy):
+                dirs.append((dx, -dy))
+            return dirs
+        if dx:
+            dirs = [(dx, 0)]
+            if blocked(x, y + 1):
+                dirs.append((dx, 1))
+            if blocked(x, y - 1):
+                dirs.append((dx, -1))
+            return dirs
+        dirs = [(0, dy)]
+        if blocked(x + 1, y):
+            dirs.append((1, dy))
+        if blocked(x - 1, y):
+            dirs.append((-1, dy))
+        return dirs
+
+    frontier = BucketQueue()
+    frontier.push(src, heuristic(graph, src, dst))
+    graph.visit(src, 0, -1)
+    (touched, expanded, pushes) = graph.get_counters()
+    pushes += 1
+
+    while not frontier.empty():
+        current = frontier.pop()
+        if closed[current] == generation:
+            continue
+        closed[current] = generation
+        expanded += 1
+        if current == dst:
+            break
 
+        (x, y) = divmod(current, height)
+        parent = previous[current]
+        if parent < 0:
+            (dx, dy) = (0, 0)
+        else:
+            (px, py) = divmod(parent, height)
+            (dx, dy) = ((x > px) - (x < px), (y > py) - (y < py))
+        current_cost = cost_so_far[current]
+        for (dx, dy) in successors(x, y, dx, dy):
+            point = jump_diagonal(x, y, dx, dy) if (dx and dy) else jump_straight(x, y, dx, dy)
+            if not point:
+                continue
+            (next_x, next_y) = point
+            next = next_x * height + next_y
+            if closed[next] == generation:
+                continue
+            steps = max(abs(next_x - x), abs(next_y - y))
+            new_cost = current_cost + (2 * steps if (dx and dy) else steps)
+            if visited[next] != generation:
+                visited[next] = generation
+                touched += 1
+            elif new_cost >= cost_so_far[next]:
+                continue
+            cost_so_far[next] = new_cost
+            frontier.push(next, new_cost + abs(next_x - dst_x) + abs(next_y - dst_y))
+            pushes += 1
+            previous[next] = current
+
+    graph.set_counters((touched, expanded, pushes))
+
+
+def bidirectional_search(graph: Graph, src: int, dst: int, window: Tuple[int, int, int, int] = None) -> None:
+    """Searches from `src` and `dst` at the same time, until the two searches prove that the best
+    path through the cells where they met is a shortest path. Then links this path like `a_star_search`.
+
+    Both searches use the average of the two Manhattan heuristics as potentials, so their keys are
+    consistent and the search can stop as soon as the sum of the lowest keys of both frontiers
+    reaches the cost of the best path found. Keys are doubled to stay integers.
+    """
+    height = graph.height
+    is_wall = graph.is_wall
+    cost_so_far = graph.cost_so_far
+    previous = graph.previous
+    visited = graph.visited
+    closed = graph.closed
+    cost_to_go = graph.cost_to_go
+    next_cell = graph.next
+    visited_reverse = graph.visited_reverse
+    closed_reverse = graph.closed_reverse
+    generation = graph.generation
+    moves = graph.moves
+    column = graph.column
+    (x_class, y_class) = graph.edge_classes(window) if window else (graph.x_class, graph.y_class)
+    (src_x, src_y) = graph.coords(src)
+    (dst_x, dst_y) = graph.coords(dst)
+
+    forward = BucketQueue()
+    reverse = BucketQueue()
+    distance = heuristic(graph, src, dst)
+    forward.push(src, distance)
+    reverse.push(dst, distance)
+    graph.visit(src, 0, -1)
+    visited_reverse[dst] = generation
+    cost_to_go[dst] = 0
+    next_cell[dst] = -1
+    (touched, expanded, pushes) = graph.get_counters()
+    touched += 1
+    pushes += 2
+    # Cost of the best path found so far, and the cell where its two halves meet
+    best = math.inf
+    meeting = -1
+    if src == dst:
+        best, meeting = 0, src
+
+    while not forward.empty() and not reverse.empty():
+        top_forward, top_reverse = forward.peek(), reverse.peek()
+        if top_forward + top_reverse >= 2 * best:
+            break
+        if top_forward <= top_reverse:
+            current = forward.pop()
+            if closed[current] == generation:
+                continue
+            closed[current] = generation
+            expanded += 1
+            (x, y) = divmod(current, height)
+            in_wall = is_wall[current]
+            current_cost = cost_so_far[current]
+            for offset, step in moves[x_class[x] | y_class[y]]:
+                next = current + offset
+                if (is_wall[next] and not in_wall) or closed[next] == generation:
+                    continue
+                new_cost = current_cost + step
+                if visited[next] != generation:
+                    visited[next] = generation
+                    touched += 1
+                elif new_cost >= cost_so_far[next]:
+                    continue
+                cost_so_far[next] = new_cost
+                previous[next] = current
+                (next_x, next_y) = divmod(next, height)
+                next_x = column[next_x]
+                forward.push(next, 2 * new_cost + abs(next_x - dst_x) + abs(next_y - dst_y) - abs(next_x - src_x) - abs(next_y - src_y))
+                pushes += 1
+                if visited_reverse[next] == generation and new_cost + cost_to_go[next] < best:
+                    best, meeting = new_cost + cost_to_go[next], next
+        else:
+            current = reverse.pop()
+            if closed_reverse[current] == generation:
+                continue
+            closed_reverse[current] = generation
+            expanded += 1
+            (x, y) = divmod(current, height)
+            in_wall = is_wall[current]
+            current_cost = cost_to_go[current]
+            # Moves are symmetric, but a wall cell can only be entered from another wall cell
+            for offset, step in moves[x_class[x] | y_class[y]]:
+                next = current + offset
+                if (in_wall and not is_wall[next]) or closed_reverse[next] == generation:
+                    continue
+                new_cost = current_cost + step
+                if visited_reverse[next] != generation:
+                    visited_reverse[next] = generation
+                    if visited[next] != generation:
+                        touched += 1
+                elif new_cost >= cost_to_go[next]:
+                    continue
+                cost_to_go[next] = new_cost
+                next_cell[next] = current
+                (next_x, next_y) = divmod(next, height)
+                next_x = column[next_x]
+                reverse.push(next, 2 * new_cost + abs(next_x - src_x) + abs(next_y - src_y) - abs(next_x - dst_x) - abs(next_y - dst_y))
+                pushes += 1
+                if visited[next] == generation and new_cost + cost_so_far[next] < best:
+                    best, meeting = new_cost + cost_so_far[next], next
+
+    # Link the second half of the path from the meeting cell to `dst`
+    if meeting >= 0:
+        current = meeting
+        while current != dst:
+            next = next_cell[current]
+            if visited[next] != generation:
+                visited[next] = generation
+                touched += 1
+            cost_so_far[next] = cost_so_far[current] + graph.cost(current, next)
+            previous[next] = current
+            current = next
+
+    graph.set_counters((touched, expanded, pushes))
+
+
+def auto_search(graph: Graph, src: int, dst: int, window: Tuple[int, int, int, int] = None) -> None:
+    """Searches from both ends if `src` and `dst` are more than `BIDIRECTIONAL_DISTANCE` apart"""
+    if heuristic(graph, src, dst) > BIDIRECTIONAL_DISTANCE:
+        bidirectional_search(graph, src, dst, window)
+    else:
+        a_star_search(graph, src, dst, window)
+
+
+ENGINES = {
+    'astar': a_star_search,
+    'jps': jump_point_search,
+    'congestion': congestion_search,
+    'bidirectional': bidirectional_search,
+    'auto': auto_search,
+}
 
-def is_turn(start: Node, mid: Node, end: Node) -> bool:
-    return not ((start.x - mid.x == mid.x - end.x) and (start.y - mid.y == mid.y - end.y))
 
+def is_turn(start: int, mid: int, end: int) -> bool:
+    # Each direction has a unique index offset, so a turn changes the offset
+    return mid - start != end - mid
+
+
+def get_corridor(graph: Graph, src: int, dst: int, factor: int) -> Tuple[Tuple[int, int, int, int], np.ndarray]:
+    """Finds a corridor from `src` to `dst` on a coarse copy of `graph`.
+
+    Each coarse cell covers `factor` x `factor` cells and is a wall if any of them is a wall on
+    every plane. The coarse cells around `src` and `dst` are freed, since pads are usually crowded
+    by the clearance of their neighbors. The corridor is the coarse path expanded by
+    `CORRIDOR_RADIUS` coarse cells.
+
+    Returns:
+        The bounding window of the corridor and the mask of the corridor cells in this window,
+        or None if there is no coarse path.
+    """
+    (cols, rows) = (-(-graph.width // factor), -(-graph.height // factor))
+    pooled = np.zeros((cols * factor, rows * factor), dtype=np.bool_)
+    pooled[:graph.width, :graph.height] = graph.walls.reshape(graph.depth, graph.width, graph.height).all(axis=0)
+    coarse = Graph(cols, rows)
+    coarse.walls[:] = pooled.reshape(cols, factor, rows, factor).any(axis=(1, 3))
+
+    ends = []
+    for cell in (src, dst):
+        (x, y) = graph.coords(cell)
+        (x, y) = (x // factor, y // factor)
+        coarse.clear_wall_rect(x - 1, x + 1, y - 1, y + 1)
+        ends.append(coarse.index(x, y))
+    a_star_search(coarse, ends[0], ends[1])
+    if not coarse.reached(ends[1]):
+        return None
+
+    mask = np.zeros((cols, rows), dtype=np.bool_)
+    r = CORRIDOR_RADIUS
+    curr = ends[1]
+    while curr >= 0:
+        (x, y) = coarse.coords(curr)
+        mask[max(x - r, 0):x + r + 1, max(y - r, 0):y + r + 1] = True
+        curr = coarse.get_previous(curr)
+    (xs, ys) = (np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0)))
+    (x1, x2, y1, y2) = (int(xs[0]) * factor, min((int(xs[-1]) + 1) * factor, graph.width) - 1,
+                        int(ys[0]) * factor, min((int(ys[-1]) + 1) * factor, graph.height) - 1)
+    mask = mask[xs[0]:xs[-1] + 1, ys[0]:ys[-1] + 1].repeat(factor, axis=0).repeat(factor, axis=1)
+    return ((x1, x2, y1, y2), mask[:x2 - x1 + 1, :y2 - y1 + 1])
+
+
+def find_path(
+        graph: Graph,
+        src: int,
+        dst: int,
+        margin: int = None,
+        engine: str = 'astar',
+        coarse: int = None,
+        windows: List[Tuple[int, int, int, int]] = None,
+        corridor: Tuple[Tuple[int, int, int, int], np.ndarray] = None,
+    ) -> List[int]:
+    """Finds a path from `src` to `dst` with one of the search `ENGINES`.
+
+    If `margin` is given, the search first runs inside the bounding box of `src` and `dst`
+    expanded by `margin`, and the margin is doubled until a path is found or the window
+    covers the whole graph. If `coarse` is given, these searches are only a fallback for a
+    search inside the corridor found on a graph coarser by this factor, see `get_corridor`.
+    A `corridor` found beforehand with `get_corridor` may be given instead of `coarse`.
+    The counters of `graph` sum up all attempts, and the windows of the attempts are appended
+    to `windows` if it is given.
+    """
+    search = ENGINES[engine]
+    counters = (0, 0, 0)
+    found = False
+    if corridor is None and coarse and coarse > 1:
+        corridor = get_corridor(graph, src, dst, coarse)
+    if corridor:
+        # Wall off the cells outside the corridor on every plane for this search only
+        (window, mask) = corridor
+        if windows is not None:
+            windows.append(window)
+        planes = graph.walls.reshape(graph.depth, graph.width, graph.height)
+        region = planes[:, window[0]:window[1] + 1, window[2]:window[3] + 1]
+        saved = region.copy()
+        region |= ~mask
+        try:
+            search(graph, src, dst, window)
+        finally:
+            region[:] = saved
+        graph.record_heat()
+        counters = graph.get_counters()
+        found = graph.reached(dst)
+        if not found:
+            graph.reset_nodes()
+
+    while not found:
+        window = None if margin is None else graph.bounding_window(src, dst, margin)
+        search(graph, src, dst, window)
+        graph.record_heat()
+        if windows is not None:
+            windows.append(window or graph.window)
+        counters = tuple(a + b for a, b in zip(counters, graph.get_counters()))
+        found = graph.reached(dst)
+        if found or window in (None, graph.window):
+            break
+        graph.reset_nodes()
+        margin = max(2 * margin, 1)
+    graph.set_counters(counters)
 
-def find_path(graph: Graph, src: Node, dst: Node) -> List[Node]:
-    a_star_search(graph, src, dst)
-    path = []
+    points = []
     curr = dst
-    while curr:
+    while curr >= 0:
+        points.append(curr)
+        curr = graph.get_previous(curr)
+    points.reverse()
+
+    # Fill in the cells between points that are more than one step apart
+    path = points[:1]
+    for curr in points[1:]:
+        (x1, y1), (x2, y2) = graph.coords(path[-1]), graph.coords(curr)
+        steps = max(abs(x2 - x1), abs(y2 - y1))
+        if steps > 1:
+            offset = ((x2 > x1) - (x2 < x1)) * graph.height + (y2 > y1) - (y2 < y1)
+            path.extend(range(path[-1] + offset, curr, offset))
         path.append(curr)
-        curr = curr.previous
-    path.reverse()
     return path
 
 
-def get_vertices(path: List[Node]) -> List[Node]:
+def get_vertices(path: List[int]) -> List[int]:
     vertices = [path[0]]
     for i in range(1, len(path) - 1):
         if is_turn(path[i - 1], path[i], path[i + 1]):
@@ -279,17 +1242,463 @@ def get_vertices(path: List[Node]) -> List[Node]:
     return vertices
 
 
-def print_graph(graph: Graph, dst: Node) -> None:
+def _sign(n: int) -> int:
+    return (n > 0) - (n < 0)
+
+
+def _line_cells(x1: int, y1: int, x2: int, y2: int) -> List[Tuple[int, int]]:
+    """Returns the 8-connected cells closest to the line between the centers of two cells"""
+    steps = max(abs(x2 - x1), abs(y2 - y1))
+    if steps == 0:
+        return [(x1, y1)]
+    return [(x1 + (2 * i * (x2 - x1) + steps) // (2 * steps), y1 + (2 * i * (y2 - y1) + steps) // (2 * steps)) for i in range(steps + 1)]
+
+
+def _cover_cells(x1: int, y1: int, x2: int, y2: int) -> List[Tuple[int, int]]:
+    """Returns the cells crossed by the line between the centers of two cells. Like diagonal moves
+    of the graph, the line may pass through a corner between two walls."""
+    (nx, ny) = (abs(x2 - x1), abs(y2 - y1))
+    (sx, sy) = (_sign(x2 - x1), _sign(y2 - y1))
+    (x, y) = (x1, y1)
+    cells = [(x, y)]
+    (ix, iy) = (0, 0)
+    while ix < nx or iy < ny:
+        # Compare the crossings of the next vertical and horizontal cell borders
+        d = (1 + 2 * ix) * ny - (1 + 2 * iy) * nx
+        if d == 0:
+            (x, y, ix, iy) = (x + sx, y + sy, ix + 1, iy + 1)
+        elif d < 0:
+            (x, ix) = (x + sx, ix + 1)
+        else:
+            (y, iy) = (y + sy, iy + 1)
+        cells.append((x, y))
+    return cells
+
+
+def _elbow_cells(x1: int, y1: int, x2: int, y2: int, diagonal_first: bool) -> List[Tuple[int, int]]:
+    """Returns the cells of a straight line and a diagonal line between two cells, like `utils.elbow`"""
+    (dx, dy) = (x2 - x1, y2 - y1)
+    diagonal = min(abs(dx), abs(dy))
+    straight = max(abs(dx), abs(dy)) - diagonal
+    diagonal_step = (_sign(dx), _sign(dy))
+    straight_step = (_sign(dx), 0) if abs(dx) > abs(dy) else (0, _sign(dy))
+    steps = [straight_step] * straight + [diagonal_step] * diagonal
+    if diagonal_first:
+        steps.reverse()
+    cells = [(x1, y1)]
+    for (sx, sy) in steps:
+        cells.append((cells[-1][0] + sx, cells[-1][1] + sy))
+    return cells
+
+
+def get_segments(graph: Graph, start: int, end: int, mode: str) -> List[Tuple[List[int], List[int]]]:
+    """Returns the ways to draw a trace from `start` to `end` on their plane in a smoothing `mode`.
+
+    Returns:
+        The cells the trace is stamped on and the cells it touches, for each way.
+    """
+    z = graph.get_plane(start)
+    (x1, y1), (x2, y2) = graph.coords(start), graph.coords(end)
+    if mode == 'any':
+        ways = [(_line_cells(x1, y1, x2, y2), _cover_cells(x1, y1, x2, y2))]
+    else:
+        ways = [(cells, cells) for cells in (_elbow_cells(x1, y1, x2, y2, False), _elbow_cells(x1, y1, x2, y2, True))]
+    return [([graph.index(x, y, z) for x, y in cells], [graph.index(x, y, z) for x, y in touched]) for cells, touched in ways]
+
+
+def _farthest(i: int, n: int, shortcut) -> Tuple[int, List[int]]:
+    """Searches for a far j up to `n - 1` whose `shortcut(j)` isn't None, by probing j at doubling
+    distances from `i`, then bisecting between the farthest success and the probe after it.
+    j = i + 1 always succeeds."""
+    (good, cells) = (i + 1, shortcut(i + 1))
+    bad = n
+    step = 2
+    while i + step // 2 < n - 1:
+        k = min(i + step, n - 1)
+        found = shortcut(k)
+        if found:
+            (good, cells, bad) = (k, found, n)
+        elif bad == n:
+            bad = k
+        step *= 2
+    while bad - good > 1:
+        k = (good + bad) // 2
+        found = shortcut(k)
+        if found:
+            (good, cells) = (k, found)
+        else:
+            bad = k
+    return (good, cells)
+
+
+def smooth_path(graph: Graph, path: List[int], mode: str) -> Tuple[List[int], List[int]]:
+    """Replaces runs of `path` by straight traces that only touch free cells, either two lines at
+    multiples of 45 degrees like `utils.elbow` ('octilinear') or one line at any angle ('any').
+
+    Both cost no more than the staircase they replace, since every monotone path of the graph costs
+    the Manhattan distance. A run is only replaced if that removes vertices. Cells inside walls and
+    changes of plane are kept as they are.
+
+    Returns:
+        The cells of the smoothed path and the cells at the vertices of its trace.
+    """
+    is_wall = graph.is_wall
+
+    def shortcut(i: int, j: int) -> List[int]:
+        if j == i + 1:
+            return path[i:j + 1]
+        if graph.get_plane(path[i]) != graph.get_plane(path[j]):
+            return None
+        for (cells, touched) in get_segments(graph, path[i], path[j], mode):
+            if not any(is_wall[c] for c in touched[1:]):
+                return cells
+        return None
+
+    smoothed = [path[0]]
+    # Lines at any angle can't be told from staircases afterwards, so their ends are kept here
+    vertices = [path[0]]
+    i = 0
+    while i < len(path) - 1:
+        (j, cells) = _farthest(i, len(path), functools.partial(shortcut, i))
+        turns = 0 if mode == 'any' else len(get_vertices(cells)) - 2
+        if turns >= len(get_vertices(path[i:j + 1])) - 2:
+            cells = path[i:j + 1]
+            vertices.extend(get_vertices(cells)[1:])
+        else:
+            vertices.append(path[j])
+        smoothed.extend(cells[1:])
+        i = j
+    return (smoothed, vertices if mode == 'any' else get_vertices(smoothed))
+
+
+@functools.lru_cache(maxsize=None)
+def _source_digest() -> str:
+    with open(__file__, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def get_route_key(graph: Graph, net: Net, margin: int, engine: str, coarse: int, smooth: str) -> str:
+    """Returns the cache key of routing `net` with these options on a graph of this size and this
+    version of the router. Walls aren't part of the key, see `get_wall_digest`."""
+    fields = [_source_digest(), graph.width, graph.height, graph.depth, list(net), margin, engine, coarse, smooth]
+    return hashlib.blake2b(json.dumps(fields).encode(), digest_size=16).hexdigest()
+
+
+def get_wall_digest(graph: Graph, windows: List[Tuple[int, int, int, int]]) -> str:
+    """Returns a digest of the walls of every plane inside `windows`"""
+    digest = hashlib.blake2b(digest_size=16)
+    planes = graph.walls.reshape(graph.depth, graph.width, graph.height)
+    for (x1, x2, y1, y2) in windows:
+        digest.update(repr((x1, x2, y1, y2)).encode())
+        digest.update(planes[:, x1:x2 + 1, y1:y2 + 1].tobytes())
+    return digest.hexdigest()
+
+
+def get_area(windows: List[Tuple[int, int, int, int]]) -> int:
+    """Returns the number of cells in the bounding box of `windows`"""
+    if not windows:
+        return 0
+    (x1, x2, y1, y2) = (min(w[0] for w in windows), max(w[1] for w in windows), min(w[2] for w in windows), max(w[3] for w in windows))
+    return (x2 - x1 + 1) * (y2 - y1 + 1)
+
+
+def get_corridor_digest(corridor: Tuple[Tuple[int, int, int, int], np.ndarray]) -> str:
+    """Returns a digest of a `corridor` returned by `get_corridor`, which depends on walls
+    anywhere in the graph"""
+    if not corridor:
+        return None
+    (window, mask) = corridor
+    digest = hashlib.blake2b(repr(window).encode(), digest_size=16)
+    digest.update(mask.tobytes())
+    return digest.hexdigest()
+
+
+def route_net(
+        graph: Graph,
+        net: Net,
+        margin: int = None,
+        engine: str = 'astar',
+        coarse: int = None,
+        smooth: str = None,
+        cache: RouteCache = None,
+    ) -> Route:
+    """Finds a path for `net` through its own pads, smoothed in one of the `SMOOTHING` modes if
+    `smooth` is given, then adds walls around the path.
+
+    If `cache` is given, the route is stored with the windows its searches read and a digest of
+    the walls inside them, and the route of the same net and options is replayed while these
+    walls and the corridor are unchanged. Replayed routes have zero search counters.
+    """
+    start = time.perf_counter()
+    graph.reset_nodes()
+    graph.open_pad(net.src_pad, graph.get_plane(net.src))
+    graph.open_pad(net.dst_pad, graph.get_plane(net.dst))
+    route = None
+    # The corridor is found once, for the cache and the search
+    corridor = get_corridor(graph, net.src, net.dst, coarse) if coarse and coarse > 1 else None
+    if cache:
+        key = get_route_key(graph, net, margin, engine, coarse, smooth)
+        corridor_digest = get_corridor_digest(corridor)
+        entry = cache.get(key)
+        if entry and entry['corridor'] == corridor_digest and entry['walls'] == get_wall_digest(graph, entry['windows']):
+            route = Route(entry['path'], entry['vertices'], (0, 0, 0), time.perf_counter() - start, get_area(entry['windows']))
+    if route is None:
+        windows = []
+        path = find_path(graph, net.src, net.dst, margin, engine, None, windows, corridor)
+        counters = graph.get_counters()
+        (path, vertices) = smooth_path(graph, path, smooth) if smooth else (path, get_vertices(path))
+        route = Route(path, vertices, counters, time.perf_counter() - start, get_area(windows))
+        if cache:
+            cache.put(key, {
+                'windows': windows,
+                'corridor': corridor_digest,
+                'walls': get_wall_digest(graph, windows),
+                'path': path,
+                'vertices': vertices,
+            })
+    graph.close_pad(net.src_pad, graph.get_plane(net.src))
+    graph.close_pad(net.dst_pad, graph.get_plane(net.dst))
+    graph.add_wall_path(route.path, net.clearance_x, net.clearance_y)
+    return route
+
+
+def get_region(graph: Graph, net: Net, margin: int) -> Tuple[int, int, int, int]:
+    """Returns the window that routing `net` reads or writes, unless the search window has to grow"""
+    (x1, x2, y1, y2) = graph.bounding_window(net.src, net.dst, margin)
+    r = max(net.src_pad[2], net.dst_pad[2]) // 2
+    return (x1 - net.clearance_x - r, x2 + net.clearance_x + r, y1 - net.clearance_y - r, y2 + net.clearance_y + r)
+
+
+def get_independent_groups(graph: Graph, nets: List[Net], margin: int) -> List[List[int]]:
+    """Groups the indices of `nets` so that nets of different groups have disjoint regions.
+    Each group keeps the order of `nets`."""
+    regions = [get_region(graph, net, margin) for net in nets]
+    group = list(range(len(nets)))
+
+    def find(i: int) -> int:
+        while group[i] != i:
+            group[i] = group[group[i]]
+            i = group[i]
+        return i
+
+    for i in range(len(nets)):
+        for j in range(i):
+            (a, b) = (regions[i], regions[j])
+            if a[0] <= b[1] and b[0] <= a[1] and a[2] <= b[3] and b[2] <= a[3]:
+                group[find(i)] = find(j)
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(nets)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def _route_group(
+        shm_name: str,
+        width: int,
+        height: int,
+        depth: int,
+        nets: List[Net],
+        margin: int,
+        engine: str,
+        coarse: int,
+        smooth: str,
+        cache: RouteCache,
+    ) -> List[Route]:
+    """Routes `nets` in order on a private copy of the shared wall counts. Runs in worker processes."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        graph = Graph(width, height, depth)
+        shared = np.ndarray(graph.wall_count.shape, dtype=np.int16, buffer=shm.buf)
+        graph.wall_count[:] = shared
+        graph.walls[:] = shared > 0
+        del shared
+    finally:
+        shm.close()
+    return [route_net(graph, net, margin, engine, coarse, smooth, cache) for net in nets]
+
+
+def route_nets(
+        graph: Graph,
+        nets: List[Net],
+        margin: int = None,
+        engine: str = 'astar',
+        workers: int = None,
+        coarse: int = None,
+        smooth: str = None,
+        cache: RouteCache = None,
+    ) -> List[Route]:
+    """Routes `nets`, in parallel where their regions are independent.
+
+    Nets are grouped by overlapping regions, and groups are routed at the same time in a pool of
+    `workers` processes (all CPUs by default) on a shared-memory copy of the walls. Results are
+    then merged in order, a group whose paths come within the clearance of an earlier group's
+    paths is rerouted serially. Without a margin every net may touch the whole graph, so nets are
+    routed serially. So are nets of a graph recording its `heat`, which workers can't add to.
+
+    Returns:
+        The route of each net.
+    """
+    groups = get_independent_groups(graph, nets, margin) if margin is not None else [list(range(len(nets)))]
+    workers = min(workers or os.cpu_count() or 1, len(groups))
+    if workers <= 1 or graph.heat is not None:
+        return [route_net(graph, net, margin, engine, coarse, smooth, cache) for net in nets]
+
+    shm = shared_memory.SharedMemory(create=True, size=graph.wall_count.nbytes)
+    try:
+        shared = np.ndarray(graph.wall_count.shape, dtype=np.int16, buffer=shm.buf)
+        shared[:] = graph.wall_count
+        del shared
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(_route_group, shm.name, graph.width, graph.height, graph.depth, [nets[i] for i in g], margin, engine, coarse, smooth, cache) for g in groups]
+            group_results = [f.result() for f in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # Paths accepted so far in this batch, with their clearance
+    batch = Graph(graph.width, graph.height, graph.depth)
+    batch_walls = batch.walls.reshape(-1)
+    results: List[Route] = [None] * len(nets)
+    for g, group_result in zip(groups, group_results):
+        if any(batch_walls[route.path].any() for route in group_result):
+            group_result = [route_net(graph, nets[i], margin, engine, coarse, smooth, cache) for i in g]
+        else:
+            for i, route in zip(g, group_result):
+                graph.add_wall_path(route.path, nets[i].clearance_x, nets[i].clearance_y)
+        for i, route in zip(g, group_result):
+            batch.add_wall_path(route.path, nets[i].clearance_x, nets[i].clearance_y)
+            results[i] = route
+    return results
+
+
+def negotiate_nets(graph: Graph, nets: List[Net], margin: int = None, iterations: int = NEGOTIATION_ITERATIONS, coarse: int = None, smooth: str = None) -> List[Route]:
+    """Routes `nets` with negotiated congestion, so that nets routed early don't block later ones.
+
+    Nets don't add walls while negotiating. Instead, each net claims the cells within its clearance
+    of its path, and entering a cell costs the history of congestion of the cell plus the number
+    of other nets claiming it times a present congestion factor. After routing every net, the nets
+    whose paths enter cells claimed by other nets are ripped up and rerouted, the history of
+    these cells grows and the present factor doubles, until no net conflicts or `iterations` run
+    out. Finally, walls are added around all paths. Nets still congested when `iterations` run
+    out are then rerouted in order with `route_net`, around the walls of all other nets.
+
+    Returns:
+        The route of each net, with the search counters of its last search.
+    """
+    usage = np.zeros(graph.walls.shape, dtype=np.int32)
+    history = np.zeros(graph.walls.shape, dtype=np.int32)
+    graph.penalty = array('i', bytes(4 * graph.cells))
+    penalty = np.frombuffer(graph.penalty, dtype=np.int32).reshape(graph.walls.shape)
+    footprints: List[List[Tuple[Tuple[slice, slice], np.ndarray]]] = [[]] * len(nets)
+    results: List[Route] = [None] * len(nets)
+    present_factor = 1
+
+    try:
+        pending = list(range(len(nets)))
+        for iteration in range(iterations):
+            for i in pending:
+                net = nets[i]
+                for (window, mask) in footprints[i]:
+                    usage[window] -= mask
+                np.multiply(usage, present_factor, out=penalty)
+                penalty += history
+
+                start = time.perf_counter()
+                graph.reset_nodes()
+                graph.open_pad(net.src_pad, graph.get_plane(net.src))
+                graph.open_pad(net.dst_pad, graph.get_plane(net.dst))
+                windows = []
+                path = find_path(graph, net.src, net.dst, margin, 'congestion', coarse, windows)
+                counters = graph.get_counters()
+                (path, vertices) = smooth_path(graph, path, smooth) if smooth else (path, get_vertices(path))
+                graph.close_pad(net.src_pad, graph.get_plane(net.src))
+                graph.close_pad(net.dst_pad, graph.get_plane(net.dst))
+
+                footprints[i] = graph.get_path_footprints(path, net.clearance_x, net.clearance_y)
+                for (window, mask) in footprints[i]:
+                    usage[window] += mask
+                results[i] = Route(path, vertices, counters, time.perf_counter() - start, get_area(windows))
+
+            # Each path lies in its own footprint, so a path cell used more than once is congested
+            flat_usage = usage.reshape(-1)
+            pending = [i for i, route in enumerate(results) if (flat_usage[route.path] > 1).any()]
+            print(f"Negotiation iteration {iteration + 1}: {len(pending)} of {len(nets)} nets congested")
+            if not pending:
+                break
+            for i in pending:
+                path = results[i].path
+                history.reshape(-1)[path] += flat_usage[path] > 1
+            present_factor *= 2
+    finally:
+        graph.penalty = None
+
+    for i, (net, route) in enumerate(zip(nets, results)):
+        if i not in pending:
+            graph.add_wall_path(route.path, net.clearance_x, net.clearance_y)
+    if pending:
+        print(f"Negotiation didn't converge, routing nets {', '.join(map(str, pending))} in order")
+        for i in pending:
+            results[i] = route_net(graph, nets[i], margin, 'astar', coarse, smooth)
+    return results
+
+
+def write_png(path: str, image: np.ndarray) -> None:
+    """Writes an RGB `image` of shape (height, width, 3) as an 8-bit PNG"""
+    (h, w, _) = image.shape
+    # Each row starts with filter type 0
+    rows = np.concatenate([np.zeros((h, 1), dtype=np.uint8), image.astype(np.uint8).reshape(h, w * 3)], axis=1)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    with open(path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)))
+        file.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        file.write(chunk(b'IEND', b''))
+
+
+def get_heatmap(graph: Graph, walls: np.ndarray = None) -> np.ndarray:
+    """Returns an RGB image of `graph` with its planes side by side, walls in gray and expanded
+    cells from yellow to red on a log scale of their `heat`. `walls` replaces the current walls
+    of `graph` if given, in the shape of `graph.walls`."""
+    image = np.full(graph.walls.shape + (3,), 255, dtype=np.uint8)
+    image[graph.walls if walls is None else walls] = 160
+    if graph.heat is not None and graph.heat.any():
+        heat = np.log1p(graph.heat) / np.log1p(graph.heat.max())
+        hot = graph.heat > 0
+        image[hot] = np.stack([np.full(hot.sum(), 255), 230 * (1 - heat[hot]), np.zeros(hot.sum())], axis=1).astype(np.uint8)
+    # Rows are y
+    return image.transpose(1, 0, 2)
+
+
+def save_heatmap(graph: Graph, path: str, walls: np.ndarray = None) -> None:
+    """Writes the `heat` and walls of `graph` as arrays of shape (depth, width, height) if `path`
+    ends with .npz, otherwise as a PNG image, see `get_heatmap`. `walls` replaces the current
+    walls of `graph` if given."""
+    walls = graph.walls if walls is None else walls
+    if path.lower().endswith('.npz'):
+        shape = (graph.depth, graph.width, graph.height)
+        heat = graph.heat if graph.heat is not None else np.zeros(graph.walls.shape, dtype=np.int32)
+        np.savez_compressed(path, heat=heat.reshape(shape), walls=walls.reshape(shape))
+    else:
+        write_png(path, get_heatmap(graph, walls))
+
+
+def print_graph(graph: Graph, dst: int) -> None:
     matrix = [[0 for y in range(graph.height)] for x in range(graph.width)]
     current = dst
-    while current:
-        matrix[current.x][current.y] = 1
-        current = current.previous
-    matrix[dst.x][dst.y] = 2
+    while current >= 0:
+        (x, y) = graph.coords(current)
+        matrix[x][y] = 1
+        current = graph.get_previous(current)
+    (x, y) = graph.coords(dst)
+    matrix[x][y] = 2
 
     for x in range(graph.width):
         for y in range(graph.height):
-            if graph.node[x][y].is_wall:
+            if graph.walls[x, y]:
                 matrix[x][y] = 3            
     
     # Print header
@@ -309,8 +1718,8 @@ def print_graph(graph: Graph, dst: Node) -> None:
 
 def main():
     graph = Graph(40, 20)
-    src = graph.node[0][0]
-    dst = graph.node[35][4]
+    src = graph.index(0, 0)
+    dst = graph.index(35, 4)
     graph.add_wall_rect(10, 14, 0, 7)
     graph.add_wall_square(23, 6, 5)
     graph.sub_wall_square(23, 6, 2)
@@ -322,4 +1731,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
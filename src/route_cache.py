@@ -0,0 +1,70 @@
+import json
+import os
+import tempfile
+
+# Bytes of entries kept on disk, the least recently used entries are evicted beyond this
+ROUTE_CACHE_SIZE = 64 * 1024 * 1024
+
+class RouteCache:
+    """A directory of JSON entries, one file per key, evicted least recently used first.
+
+    Entries are written atomically, so processes routing in parallel may share a cache.
+    Reading an entry bumps its modification time, which orders the eviction.
+    """
+
+    def __init__(self, path: str, max_size: int = ROUTE_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, key: str) -> dict:
+        """Returns the entry of `key`, or None if there is none"""
+        file = self._file(key)
+        try:
+            with open(file) as f:
+                entry = json.load(f)
+            os.utime(file)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        """Stores `entry` under `key`, replacing the previous one, then evicts entries beyond `max_size`"""
+        os.makedirs(self.path, exist_ok=True)
+        (fd, tmp) = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f, separators=(',', ':'))
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        files = []
+        for e in os.scandir(self.path):
+            if e.name.endswith('.json'):
+                try:
+                    stat = e.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, e.path))
+        total = sum(size for _, size, _ in files)
+        for (_, size, file) in sorted(files):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        if not os.path.isdir(self.path):
+            return
+        for e in os.scandir(self.path):
+            if e.name.endswith('.json'):
+                os.remove(e.path)
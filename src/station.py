@@ -1,4 +1,5 @@
 import math
+import numpy as np
 import os
 import pcbnew
 from pcbnew import BOARD, FromMM, wxPoint
@@ -7,11 +8,28 @@ from typing import List, Tuple
 from coil import Coil, CoilStyle
 from cuboid import Cuboid
 import path_finder
+from route_cache import RouteCache
 from schematic import StationSchematic
 import utils
 import vector
 
 AUTOROUTER = False
+# Search engine of the built-in router, see path_finder.ENGINES
+ROUTER_ENGINE = 'astar'
+# Worker processes for routing independent nets in parallel, all CPUs if None. Serial by default,
+# since starting the pool costs more than routing the few nets of a station.
+ROUTER_WORKERS = 1
+# Negotiate congestion between nets instead of routing them greedily in a hand-tuned order
+ROUTER_NEGOTIATED = False
+# Route on both copper layers at once, so that nets can change layers through vias
+ROUTER_3D = False
+# Smoothing of routed traces, see path_finder.SMOOTHING, disabled if None
+ROUTER_SMOOTH = None
+# Directory of the on-disk cache of routed nets shared by all runs, disabled if None.
+# generate.py sets it with --cache.
+ROUTER_CACHE = None
+# Directory of per-net routing statistics and a heatmap of expanded cells as PNG and NPZ, not written if None
+ROUTER_STATS = None
 
 class Station(Cuboid):
 
@@ -26,8 +44,8 @@ class Station(Cuboid):
         self.coil: List[Coil] = []
         for i in range(self.side):
             for j in range(self.coil_n):
-                self.coil.append(Coil(self.board, self.coil_style, wxPoint(i * self.length + (j + 0.5) * l, -0.5 * l), math.radians(90), True))
-        self.coil.append(Coil(self.board, self.coil_style, wxPoint(2 * self.length + margin_l, self.height - margin_b), 0))
+                self.coil.append(Coil(self.builder, self.coil_style, wxPoint(i * self.length + (j + 0.5) * l, -0.5 * l), math.radians(90), True))
+        self.coil.append(Coil(self.builder, self.coil_style, wxPoint(2 * self.length + margin_l, self.height - margin_b), 0))
 
     def _init_footprints(self) -> None:
         self.c_coil: List[pcbnew.FOOTPRINT]= [self.board.FindFootprintByReference(p.ref) for p in self.sch.c_coil]
@@ -76,6 +94,7 @@ class Station(Cuboid):
 
         # Call third-party router
         project_name = os.path.splitext(self.board.GetFileName())[0]
+        self.builder.commit()
         utils.route(self.board, project_name)
         self._update_board()
 
@@ -94,13 +113,13 @@ class Station(Cuboid):
             cross.append(p)
             traces[i] = [p] + traces[i][j + 1:]
 
-        utils.via(self.board, cross[0], self.coil_style.track_w, pcbnew.F_Cu, pcbnew.B_Cu)
+        utils.via(self.builder, cross[0], self.coil_style.track_w, pcbnew.F_Cu, pcbnew.B_Cu)
         for i in range(len(cross) - 1):
             if cross[i].x == cross[i + 1].x or cross[i].y == cross[i + 1].y:
-                utils.segment(self.board, cross[i], cross[i + 1], self.coil_style.track_w, pcbnew.B_Cu)
+                utils.segment(self.builder, cross[i], cross[i + 1], self.coil_style.track_w, pcbnew.B_Cu)
             else:
-                utils.polyline(self.board, [cross[i], origin, cross[i + 1]], self.coil_style.track_w, pcbnew.B_Cu)
-            utils.via(self.board, cross[i + 1], self.coil_style.track_w, pcbnew.F_Cu, pcbnew.B_Cu)
+                utils.polyline(self.builder, [cross[i], origin, cross[i + 1]], self.coil_style.track_w, pcbnew.B_Cu)
+            utils.via(self.builder, cross[i + 1], self.coil_style.track_w, pcbnew.F_Cu, pcbnew.B_Cu)
 
         return cross
 
@@ -117,35 +136,50 @@ class Station(Cuboid):
         hf_track_clearance_y = FromMM(4)
         hf_pad_clearance = FromMM(1)
         grid_size = FromMM(0.2)
-        grid = path_finder.Grid(self.board, 0, self.length * self.side, self.c_coil[0].GetY(), self.height, grid_size)
+        search_margin = FromMM(10)
+        coarse_size = FromMM(1)
+        layers = [pcbnew.F_Cu, pcbnew.B_Cu] if ROUTER_3D else None
+        cache = RouteCache(ROUTER_CACHE) if ROUTER_CACHE else None
+        grid = path_finder.Grid(self.builder, 0, self.length * self.side, self.c_coil[0].GetY(), self.height, grid_size, search_margin, ROUTER_ENGINE, coarse_size, layers, ROUTER_SMOOTH, cache)
+        if ROUTER_STATS:
+            grid.graph.heat = np.zeros(grid.graph.walls.shape, dtype=np.int32)
         pads = self.board.GetPads()
         hf_pad = ["9", "8", "7", "6", "5", "4", "3", "2", "23", "22", "21", "20", "19", "18", "17", "16", "1"]
         mux_coil_pad = hf_pad[:-1]
         mux_ant_pad = hf_pad[-1]
 
         # ==================== Add walls to all pads ====================
-        for pad in pads:
-            if pad.GetParent().GetReference() == 'U1' and pad.GetName() in hf_pad:
-                grid.add_wall_pad(pad, hf_pad_clearance)
-            else:
-                grid.add_wall_pad(pad, pad_clearance)
+        with grid.graph.wall_layer('pads'):
+            for pad in pads:
+                if pad.GetParent().GetReference() == 'U1' and pad.GetName() in hf_pad:
+                    grid.add_wall_pad(pad, hf_pad_clearance)
+                else:
+                    grid.add_wall_pad(pad, pad_clearance)
 
         # ==================== Route traces from the mux to capacitors ====================
         pads_mux_cap: List[Tuple[pcbnew.PAD, pcbnew.PAD]] = [(self.mux.FindPadByNumber(mux_coil_pad[i]), self.c_coil[i].Pads()[1]) for i in range(self.stack_n)]
-        pads_mux_cap.sort(key=lambda e: abs(e[0].GetX() - e[1].GetX()), reverse=True)
+        if not ROUTER_NEGOTIATED:
+            pads_mux_cap.sort(key=lambda e: abs(e[0].GetX() - e[1].GetX()), reverse=True)
         pads_mux_cap.append((self.mux.FindPadByNumber(mux_ant_pad), self.c_coil[-1].Pads()[0]))
 
         # Add a spacer to reserve space for the return path that will possibly pass by
         spacer_pos = self.head_ant.FindPadByNumber('1').GetPosition() + wxPoint(FromMM(2.5), 0)
         spacer_start = grid.pcb_to_grid(spacer_pos + wxPoint(0, FromMM(-4)))
         spacer_end = grid.pcb_to_grid(spacer_pos + wxPoint(0, FromMM(6)))
-        grid.graph.add_wall_rect(spacer_start[0], spacer_end[0], spacer_start[1], spacer_end[1])
+        with grid.graph.wall_layer('spacer'):
+            grid.graph.add_wall_rect(spacer_start[0], spacer_end[0], spacer_start[1], spacer_end[1])
+
+        if ROUTER_NEGOTIATED:
+            traces_mux_cap = grid.route_negotiated(pads_mux_cap, self.coil_style.track_w, pcbnew.F_Cu, hf_pad_clearance, hf_track_clearance_x, hf_track_clearance_y)
+        else:
+            traces_mux_cap = [grid.route_pad_to_pad(src_pad, dst_pad, self.coil_style.track_w, pcbnew.F_Cu, hf_pad_clearance, hf_track_clearance_x, hf_track_clearance_y)
+                              for src_pad, dst_pad in pads_mux_cap]
 
-        traces_mux_cap = [grid.route_pad_to_pad(src_pad, dst_pad, self.coil_style.track_w, pcbnew.F_Cu, hf_pad_clearance, hf_track_clearance_x, hf_track_clearance_y)
-                          for src_pad, dst_pad in pads_mux_cap]
+        # Walls the top layer nets were routed on, for the heatmap
+        routed_walls = grid.graph.walls.copy() if ROUTER_STATS else None
 
         # Remove the spacer
-        grid.graph.sub_wall_rect(spacer_start[0], spacer_end[0], spacer_start[1], spacer_end[1])
+        grid.graph.remove_wall_layer('spacer')
 
         # ==================== Route traces from the mcu to the ftdi header ====================
         pads_mcu_ftdi = [
@@ -155,8 +189,6 @@ class Station(Cuboid):
             (self.mcu.FindPadByNumber('JP1_5'), self.head_ftdi.FindPadByNumber('1')),
             (self.mcu.FindPadByNumber('JP1_5'), self.mcu.FindPadByNumber('JP1_6')),
         ]
-        traces_mcu_ftdi = [grid.route_pad_to_pad(src_pad, dst_pad, track_w, pcbnew.F_Cu, pad_clearance, track_clearance_x, track_clearance_y)
-                           for src_pad, dst_pad in pads_mcu_ftdi]
 
         # ==================== Route traces from the antenna header to the mcu ====================
         pads_ant_mcu = [
@@ -165,8 +197,9 @@ class Station(Cuboid):
             (self.head_ant.FindPadByNumber('2'), self.mcu.FindPadByNumber('JP1_4')),
             (self.head_ant.FindPadByNumber('1'), self.mcu.FindPadByNumber('JP1_5')),
         ]
-        traces_ant_mcu = [grid.route_pad_to_pad(src_pad, dst_pad, track_w, pcbnew.F_Cu, pad_clearance, track_clearance_x, track_clearance_y)
-                          for src_pad, dst_pad in pads_ant_mcu]
+        traces_mcu = grid.route_batch(pads_mcu_ftdi + pads_ant_mcu, track_w, pcbnew.F_Cu, pad_clearance, track_clearance_x, track_clearance_y, ROUTER_WORKERS)
+        traces_mcu_ftdi = traces_mcu[:len(pads_mcu_ftdi)]
+        traces_ant_mcu = traces_mcu[len(pads_mcu_ftdi):]
 
         # ==================== Route traces from the mux to the mcu ====================
         pads_mux_mcu = [
@@ -187,23 +220,24 @@ class Station(Cuboid):
                 grid.pcb_to_grid(self.mux.FindPadByNumber('13').GetPosition() + wxPoint(FromMM(2), FromMM(-2))),
             ),
         ]
-        for s in spacer:
-            grid.graph.add_wall_rect(s[0][0], s[1][0], s[0][1], s[1][1])
+        with grid.graph.wall_layer('spacer'):
+            for s in spacer:
+                grid.graph.add_wall_rect(s[0][0], s[1][0], s[0][1], s[1][1])
+
+        if ROUTER_NEGOTIATED:
+            traces_mux_mcu = grid.route_negotiated(pads_mux_mcu, track_w, pcbnew.F_Cu, pad_clearance, track_clearance_x, track_clearance_y)
+        else:
+            traces_mux_mcu = grid.route_batch(pads_mux_mcu, track_w, pcbnew.F_Cu, pad_clearance, track_clearance_x, track_clearance_y, ROUTER_WORKERS)
 
-        traces_mux_mcu = [grid.route_pad_to_pad(src_pad, dst_pad, track_w, pcbnew.F_Cu, pad_clearance, track_clearance_x, track_clearance_y)
-                          for src_pad, dst_pad in pads_mux_mcu]
+        # Walls the top layer nets were routed on, for the heatmap
+        routed_walls = grid.graph.walls.copy() if ROUTER_STATS else None
 
         # Remove the spacer
-        for s in spacer:
-            grid.graph.sub_wall_rect(s[0][0], s[1][0], s[0][1], s[1][1])
-
-        # ==================== Reset walls and add walls to all pads ====================
-        grid.graph.reset_walls()
-        for pad in pads:
-            if pad.GetParent().GetReference() == 'U1' and pad.GetName() in hf_pad:
-                grid.add_wall_pad(pad, hf_pad_clearance)
-            else:
-                grid.add_wall_pad(pad, pad_clearance)
+        grid.graph.remove_wall_layer('spacer')
+
+        # ==================== Remove walls of the top layer traces, keeping the pads ====================
+        if not ROUTER_3D:
+            grid.graph.remove_wall_layer(grid.get_trace_layer(pcbnew.F_Cu))
 
         # ==================== Route VCC and GND from the ftdi header to the mux (bottom layer) ====================
         pads_ftdi_mux = [
@@ -213,6 +247,13 @@ class Station(Cuboid):
         traces_ftdi_mux = [grid.route_pad_to_pad(src_pad, dst_pad, track_w, pcbnew.B_Cu, pad_clearance, track_clearance_x, track_clearance_y)
                           for src_pad, dst_pad in pads_ftdi_mux]
 
+        if ROUTER_STATS:
+            os.makedirs(ROUTER_STATS, exist_ok=True)
+            project_name = os.path.basename(os.path.splitext(self.board.GetFileName())[0])
+            grid.save_stats(os.path.join(ROUTER_STATS, project_name + '-route-stats.json'))
+            for ext in ('.png', '.npz'):
+                path_finder.save_heatmap(grid.graph, os.path.join(ROUTER_STATS, project_name + '-route-heat' + ext), routed_walls)
+
         # ==================== Route return paths from the capacitors ====================
         distance = FromMM(0.5) + self.coil_style.track_w
 
@@ -232,13 +273,13 @@ class Station(Cuboid):
 
         for trace, cap in zip(traces_rtn_left, caps_left):
             trace[-1] = cap.Pads()[0].GetPosition()
-            utils.polyline(self.board, trace, self.coil_style.track_w, pcbnew.F_Cu)
+            utils.polyline(self.builder, trace, self.coil_style.track_w, pcbnew.F_Cu)
         for trace, cap in zip(traces_rtn_right, caps_right):
             trace[-1] = cap.Pads()[0].GetPosition()
-            utils.polyline(self.board, trace, self.coil_style.track_w, pcbnew.F_Cu)
+            utils.polyline(self.builder, trace, self.coil_style.track_w, pcbnew.F_Cu)
 
-        utils.elbow(self.board, self.c_coil[-1].Pads()[1].GetPosition(), cross_left[0], self.coil_style.track_w, pcbnew.F_Cu)
-        utils.elbow(self.board, cross_right[0], self.c_coil[-1].Pads()[1].GetPosition(), self.coil_style.track_w, pcbnew.F_Cu)
+        utils.elbow(self.builder, self.c_coil[-1].Pads()[1].GetPosition(), cross_left[0], self.coil_style.track_w, pcbnew.F_Cu)
+        utils.elbow(self.builder, cross_right[0], self.c_coil[-1].Pads()[1].GetPosition(), self.coil_style.track_w, pcbnew.F_Cu)
 
     def _create_coils(self) -> None:
         for cap, co in zip(self.c_coil, self.coil):
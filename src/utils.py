@@ -2,7 +2,7 @@ import math
 import os
 import pcbnew
 from pcbnew import wxPoint, BOARD
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
 
 import vector
 
@@ -10,7 +10,106 @@ def get_layer_table(board: BOARD) -> Dict[str, int]:
     return {board.GetLayerName(i): i for i in range(pcbnew.PCB_LAYER_ID_COUNT)}
 
 
-def segment(board: BOARD, start: wxPoint, end: wxPoint, width: int, layer: int, is_track: bool = True) -> None:
+Point = Tuple[int, int]
+
+def _continues(u: Point, p: Point, q: Point) -> bool:
+    """Returns whether p lies strictly between u and q on the line through them"""
+    (ux, uy, qx, qy) = (u[0] - p[0], u[1] - p[1], q[0] - p[0], q[1] - p[1])
+    return ux * qy == uy * qx and ux * qx + uy * qy < 0
+
+
+def _merge_collinear(segments: List[Tuple[Point, Point]]) -> List[Tuple[Point, Point]]:
+    """Merges segments that share an end and continue each other in a straight line"""
+    merged: List[Optional[Tuple[Point, Point]]] = []
+    ends: Dict[Point, List[int]] = {}
+    for seg in segments:
+        i = len(merged)
+        merged.append(seg)
+        joined = True
+        while joined:
+            joined = False
+            for p, q in (merged[i], merged[i][::-1]):
+                for j in ends.get(p, ()):
+                    u = merged[j][1] if merged[j][0] == p else merged[j][0]
+                    if _continues(u, p, q):
+                        for end in merged[j]:
+                            ends[end].remove(j)
+                        (merged[i], merged[j]) = ((u, q), None)
+                        joined = True
+                        break
+                if joined:
+                    break
+        for end in merged[i]:
+            ends.setdefault(end, []).append(i)
+    return [seg for seg in merged if seg]
+
+
+class BoardBuilder:
+    """Buffers the tracks, vias and shapes drawn with the helpers of this module, which take a
+    builder in place of a board, and adds them to the board at once in `commit`.
+
+    On commit, collinear segments that touch and share a width and layer are merged, and duplicate
+    vias are dropped. Until then, the buffered items are only seen through `get_segments`.
+    """
+
+    def __init__(self, board: BOARD):
+        self.board = board
+        self.segments: Dict[Tuple[int, int, bool], List[Tuple[Point, Point]]] = {}
+        self.circles: List[Tuple[Point, Point, int, int, bool]] = []
+        self.vias: Dict[Tuple[Point, int, int, int], None] = {}
+
+    def add_segment(self, start: wxPoint, end: wxPoint, width: int, layer: int, is_track: bool) -> None:
+        self.segments.setdefault((width, layer, is_track), []).append(((start.x, start.y), (end.x, end.y)))
+
+    def add_circle(self, pos: wxPoint, end: wxPoint, width: int, layer: int, is_track: bool) -> None:
+        self.circles.append(((pos.x, pos.y), (end.x, end.y), width, layer, is_track))
+
+    def add_via(self, pos: wxPoint, diameter: int, top_layer: int, bottom_layer: int) -> None:
+        self.vias[((pos.x, pos.y), diameter, top_layer, bottom_layer)] = None
+
+    def get_segments(self) -> Iterator[Tuple[wxPoint, wxPoint, int]]:
+        """Yields the start, end and width of the items on the board and in the buffer, measured
+        the way `hit_something` measures them"""
+        for item in list(self.board.GetTracks()) + list(self.board.GetDrawings()):
+            yield (item.GetStart(), item.GetEnd(), item.GetWidth())
+        for (width, _, _), segments in self.segments.items():
+            for start, end in segments:
+                yield (wxPoint(*start), wxPoint(*end), width)
+        for start, end, width, _, _ in self.circles:
+            yield (wxPoint(*start), wxPoint(*end), width)
+        for pos, diameter, _, _ in self.vias:
+            yield (wxPoint(*pos), wxPoint(*pos), diameter)
+
+    def commit(self) -> None:
+        """Adds the buffered items to the board and empties the buffer"""
+        board = self.board
+        for (width, layer, is_track), segments in self.segments.items():
+            for start, end in _merge_collinear(segments):
+                _add_segment(board, wxPoint(*start), wxPoint(*end), width, layer, is_track)
+        for pos, end, width, layer, is_track in self.circles:
+            _add_circle(board, wxPoint(*pos), wxPoint(*end), width, layer, is_track)
+        for pos, diameter, top_layer, bottom_layer in self.vias:
+            _add_via(board, wxPoint(*pos), diameter, top_layer, bottom_layer)
+        self.segments.clear()
+        self.circles.clear()
+        self.vias.clear()
+
+
+def _get_segments(board: Union[BOARD, BoardBuilder]) -> Iterator[Tuple[wxPoint, wxPoint, int]]:
+    if isinstance(board, BoardBuilder):
+        return board.get_segments()
+    items = list(board.GetTracks()) + list(board.GetDrawings())
+    return ((item.GetStart(), item.GetEnd(), item.GetWidth()) for item in items)
+
+
+def segment(board: Union[BOARD, BoardBuilder], start: wxPoint, end: wxPoint, width: int, layer: int, is_track: bool = True) -> None:
+    if isinstance(board, BoardBuilder):
+        board.add_segment(start, end, width, layer, is_track)
+    else:
+        _add_segment(board, start, end, width, layer, is_track)
+
+
+def _add_segment(board: BOARD, start: wxPoint, end: wxPoint, width: int, layer: int, is_track: bool) -> None:
     seg = pcbnew.PCB_TRACK(board) if is_track else pcbnew.PCB_SHAPE(board)
     board.Add(seg)
     seg.SetStart(start)
@@ -19,7 +118,7 @@ def segment(board: BOARD, start: wxPoint, end: wxPoint, width: int, layer: int,
     seg.SetLayer(layer)
 
 
-def elbow(board: BOARD, start: wxPoint, end: wxPoint, width: int, layer: int, is_track: bool = True) -> None:
+def elbow(board: Union[BOARD, BoardBuilder], start: wxPoint, end: wxPoint, width: int, layer: int, is_track: bool = True) -> None:
     v = end - start
     l = min(abs(v.x), abs(v.y))
     diagonal = wxPoint(l, l)
@@ -30,22 +129,37 @@ def elbow(board: BOARD, start: wxPoint, end: wxPoint, width: int, layer: int, is
     polyline(board, [start, end - diagonal, end], width, layer, is_track)
 
 
-def circle(board: BOARD, pos: wxPoint, diameter: int, width: int, layer: int, is_track: bool = True) -> None:
+def circle(board: Union[BOARD, BoardBuilder], pos: wxPoint, diameter: int, width: int, layer: int, is_track: bool = True) -> None:
+    end = pos + wxPoint(diameter / 2, 0)
+    if isinstance(board, BoardBuilder):
+        board.add_circle(pos, end, width, layer, is_track)
+    else:
+        _add_circle(board, pos, end, width, layer, is_track)
+
+
+def _add_circle(board: BOARD, pos: wxPoint, end: wxPoint, width: int, layer: int, is_track: bool) -> None:
     seg = pcbnew.PCB_TRACK(board) if is_track else pcbnew.PCB_SHAPE(board)
     board.Add(seg)
     seg.SetShape(pcbnew.SHAPE_T_CIRCLE)
     seg.SetStart(pos)
-    seg.SetEnd(pos + wxPoint(diameter / 2, 0))
+    seg.SetEnd(end)
     seg.SetWidth(width)
     seg.SetLayer(layer)
 
 
-def polyline(board: BOARD, points: List[wxPoint], width: int, layer: int, is_track: bool = True) -> None:
+def polyline(board: Union[BOARD, BoardBuilder], points: List[wxPoint], width: int, layer: int, is_track: bool = True) -> None:
     for i in range(len(points) - 1):
         segment(board, points[i], points[i + 1], width, layer, is_track)
 
 
-def via(board: BOARD, pos: wxPoint, diameter: int, top_layer: int, bottom_layer: int) -> None:
+def via(board: Union[BOARD, BoardBuilder], pos: wxPoint, diameter: int, top_layer: int, bottom_layer: int) -> None:
+    if isinstance(board, BoardBuilder):
+        board.add_via(pos, diameter, top_layer, bottom_layer)
+    else:
+        _add_via(board, pos, diameter, top_layer, bottom_layer)
+
+
+def _add_via(board: BOARD, pos: wxPoint, diameter: int, top_layer: int, bottom_layer: int) -> None:
     new_via = pcbnew.PCB_VIA(board)
     board.Add(new_via)
     new_via.SetLayerPair(top_layer, bottom_layer)
@@ -75,22 +189,191 @@ def add_zone(board: BOARD, x1: int, x2: int, y1: int, y2: int) -> None:
     new_area.SetLayerSet(pcbnew.LSET(pcbnew.F_Cu).AddLayer(pcbnew.B_Cu))
 
 
-def fold_line(board: BOARD, start: wxPoint, end: wxPoint, diameter: int, distance: int, outline_width: int, clearance: int) -> None:
+class SegmentIndex:
+    """A uniform bucket grid of the segments of a board's tracks and drawings, for clearance queries.
+
+    Circles and vias are indexed as the segment from their start to their end, the same way
+    `hit_something` has always measured them. Items added to the board afterwards must also be
+    added to the index with `add`.
+    """
+
+    def __init__(self, board: Union[BOARD, BoardBuilder] = None, cell: int = pcbnew.FromMM(1)):
+        self.cell = cell
+        self.segments: List[Tuple[wxPoint, wxPoint, int]] = []
+        self.buckets: Dict[Tuple[int, int], List[int]] = {}
+        if board is not None:
+            for start, end, width in _get_segments(board):
+                self.add(start, end, width)
+
+    def _cells(self, start: wxPoint, end: wxPoint, pad: float) -> Iterator[Tuple[int, int]]:
+        """Yields the cells whose boxes grown by `pad` may intersect the segment, column by column"""
+        if start.x > end.x:
+            start, end = end, start
+        cell = self.cell
+        for cx in range(int((start.x - pad) // cell), int((end.x + pad) // cell) + 1):
+            lo = max(start.x, cx * cell - pad)
+            hi = min(end.x, (cx + 1) * cell + pad)
+            if lo > hi:
+                continue
+            if start.x == end.x:
+                (y1, y2) = (start.y, end.y)
+            else:
+                slope = (end.y - start.y) / (end.x - start.x)
+                (y1, y2) = (start.y + slope * (lo - start.x), start.y + slope * (hi - start.x))
+            for cy in range(int((min(y1, y2) - pad) // cell), int((max(y1, y2) + pad) // cell) + 1):
+                yield (cx, cy)
+
+    def add(self, start: wxPoint, end: wxPoint, width: int) -> None:
+        self.segments.append((vector.copy(start), vector.copy(end), width))
+        i = len(self.segments) - 1
+        # 1 IU of slack against rounding at cell borders
+        for key in self._cells(start, end, width / 2 + 1):
+            self.buckets.setdefault(key, []).append(i)
+
+    def query(self, x1: float, y1: float, x2: float, y2: float) -> Set[int]:
+        """Returns the indices of the segments whose padded footprints may touch the box"""
+        cell = self.cell
+        candidates = set()
+        for cx in range(int(x1 // cell), int(x2 // cell) + 1):
+            for cy in range(int(y1 // cell), int(y2 // cell) + 1):
+                candidates.update(self.buckets.get((cx, cy), ()))
+        return candidates
+
+    def hit(self, pos: wxPoint, diameter: int, clearance: int) -> bool:
+        """Returns whether a circle of `diameter` at `pos` is within `clearance` of any segment"""
+        r = diameter / 2 + clearance
+        for i in self.query(pos.x - r, pos.y - r, pos.x + r, pos.y + r):
+            (start, end, width) = self.segments[i]
+            if vector.dot_to_segment(pos, start, end) <= (diameter + width) / 2 + clearance:
+                return True
+        return False
+
+
+# Holes this close to the end of a blocked interval are tested exactly, to absorb rounding
+_FOLD_LINE_TOLERANCE = pcbnew.FromMM(0.001)
+
+def _blocked_interval(start: Tuple[int, int], end: Tuple[int, int], radius: float, across: int) -> Optional[Tuple[float, float]]:
+    """Returns the interval of the line at `across` that lies within `radius` of the segment, in
+    (along, across) coordinates, or None if the line misses the capsule"""
+    (sa, sc), (ea, ec) = start, end
+    ends = []
+    for a, c in (start, end):
+        h = c - across
+        if abs(h) <= radius:
+            half = math.sqrt(radius * radius - h * h)
+            ends += [a - half, a + half]
+    # The band of the segment's body, where the projection lies on the segment
+    (va, vc) = (ea - sa, ec - sc)
+    norm2 = va * va + vc * vc
+    if norm2 > 0:
+        h = sc - across
+        (lo, hi) = (-math.inf, math.inf)
+        if va:
+            (t1, t2) = ((h * vc) / va, (norm2 + h * vc) / va)
+            (lo, hi) = (min(t1, t2), max(t1, t2))
+        elif not 0 <= -h * vc <= norm2:
+            (lo, hi) = (math.inf, -math.inf)
+        band = radius * math.sqrt(norm2)
+        if vc:
+            (t1, t2) = ((-band - h * va) / vc, (band - h * va) / vc)
+            (lo, hi) = (max(lo, min(t1, t2)), min(hi, max(t1, t2)))
+        elif abs(h) > radius:
+            (lo, hi) = (math.inf, -math.inf)
+        if lo <= hi:
+            ends += [sa + lo, sa + hi]
+    return (min(ends), max(ends)) if ends else None
+
+
+def _merge(intervals: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    merged = []
+    for lo, hi in sorted(intervals):
+        if lo > hi:
+            continue
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def _classify_holes(index: SegmentIndex, holes: List[wxPoint], diameter: int, clearance: int) -> List[Optional[bool]]:
+    """Tells for each hole on an axis-aligned line whether the indexed segments block it, from the
+    intervals they block along the line in one sorted pass. None means too close to call."""
+    horizontal = holes[0].y == holes[-1].y
+    to_line = (lambda p: (p.x, p.y)) if horizontal else (lambda p: (p.y, p.x))
+    (a1, across) = to_line(holes[0])
+    a2 = to_line(holes[-1])[0]
+    (a1, a2) = (min(a1, a2), max(a1, a2))
+    r = diameter / 2 + clearance
+    box = (a1 - r, across - r, a2 + r, across + r) if horizontal else (across - r, a1 - r, across + r, a2 + r)
+
+    intervals = []
+    for i in index.query(*box):
+        (start, end, width) = index.segments[i]
+        interval = _blocked_interval(to_line(start), to_line(end), (diameter + width) / 2 + clearance, across)
+        if interval:
+            intervals.append(interval)
+    tol = _FOLD_LINE_TOLERANCE
+    sure = _merge([(lo + tol, hi - tol) for lo, hi in intervals])
+    maybe = _merge([(lo - tol, hi + tol) for lo, hi in intervals])
+
+    status: List[Optional[bool]] = [False] * len(holes)
+    (i, j) = (0, 0)
+    for k in sorted(range(len(holes)), key=lambda k: to_line(holes[k])[0]):
+        a = to_line(holes[k])[0]
+        while i < len(sure) and sure[i][1] < a:
+            i += 1
+        while j < len(maybe) and maybe[j][1] < a:
+            j += 1
+        if i < len(sure) and sure[i][0] <= a:
+            status[k] = True
+        elif j < len(maybe) and maybe[j][0] <= a:
+            status[k] = None
+    return status
+
+
+def fold_line(board: Union[BOARD, BoardBuilder], start: wxPoint, end: wxPoint, diameter: int, distance: int, outline_width: int, clearance: int, index: SegmentIndex = None) -> None:
+    """Perforates a fold line with holes that keep clear of the board's items. Pass the same `index`
+    to successive calls to build it once, the holes placed here are added to it.
+
+    Holes of axis-aligned lines are classified at once by `_classify_holes`, and only tested
+    against the holes placed before them on the same line.
+    """
+    if index is None:
+        index = SegmentIndex(board)
     diff = end - start
     length = vector.mag(diff)
     n = int(length) // distance
     increment = vector.divided(diff, n)
-    for i in range(n + 1):
-        pos = start + vector.multiplied(increment, i)
-        if not hit_something(board, pos, diameter, clearance):
+    holes = [start + vector.multiplied(increment, i) for i in range(n + 1)]
+    status = _classify_holes(index, holes, diameter, clearance) if (diff.x == 0 or diff.y == 0) else [None] * len(holes)
+
+    # A placed hole is indexed as a segment of `diameter / 2` along x, see `circle`
+    reach = diameter / 2 + (diameter + outline_width) / 2 + clearance
+    placed: List[Tuple[wxPoint, wxPoint]] = []
+    for pos, blocked in zip(holes, status):
+        if blocked is None:
+            blocked = index.hit(pos, diameter, clearance)
+        elif not blocked:
+            for q, q_end in reversed(placed):
+                if vector.dot_to_dot(pos, q) > reach:
+                    break
+                if vector.dot_to_segment(pos, q, q_end) <= (diameter + outline_width) / 2 + clearance:
+                    blocked = True
+                    break
+        if not blocked:
             circle(board, pos, diameter, outline_width, pcbnew.Edge_Cuts, False)
+            index.add(pos, pos + wxPoint(diameter / 2, 0), outline_width)
+            placed.append((pos, pos + wxPoint(diameter / 2, 0)))
 
 
-def hit_something(board: BOARD, pos: wxPoint, diameter: int, clearance: int) -> bool:
-    min_dist = lambda item: (diameter + item.GetWidth()) / 2 + clearance
-    return (
-        any(vector.dot_to_segment(pos, t.GetStart(), t.GetEnd()) <= min_dist(t) for t in board.GetTracks()) or
-        any(vector.dot_to_segment(pos, d.GetStart(), d.GetEnd()) <= min_dist(d) for d in board.GetDrawings())
+def hit_something(board: Union[BOARD, BoardBuilder], pos: wxPoint, diameter: int, clearance: int, index: SegmentIndex = None) -> bool:
+    """Looks up nearby segments in `index` if given, otherwise scans every item of the board"""
+    if index is not None:
+        return index.hit(pos, diameter, clearance)
+    return any(
+        vector.dot_to_segment(pos, start, end) <= (diameter + width) / 2 + clearance
+        for start, end, width in _get_segments(board)
     )
 
 
@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+# The path_finder tests stand in for a missing pcbnew with bench/fake_pcbnew
+if pytest.importorskip('pcbnew').__name__ != 'pcbnew':
+    pytest.skip('needs the pcbnew module of KiCad', allow_module_level=True)
+pytest.importorskip('skidl')
+
+import batch
+import daemon
+import generate
+
+
+def test_get_argv_puts_extra_options_before_positionals():
+    argv = batch.get_argv({'file': 'a', 'size': 40, 'layers': 3}, ['--output-dir', 'out'])
+    assert argv == ['--output-dir', 'out', '--', 'a', '40', '3']
+    args = generate.parse_args(argv)
+    assert (args.output_dir, args.file, args.size, args.layers) == ('out', 'a', 40, 3)
+
+
+def test_serve_lines_generates_a_box(tmp_path):
+    request = {'id': 7, 'file': 'box', 'size': 40, 'layers': 2, 'box': True, 'output_dir': str(tmp_path)}
+    lines = []
+    daemon.serve_lines([json.dumps(request)], lines.append)
+
+    events = [json.loads(line) for line in lines]
+    assert [e['event'] for e in events] == ['started', 'done']
+    done = events[-1]
+    assert done['id'] == 7
+    assert done['ok'], done['errors']
+    assert done['artifacts']
+    for path in done['artifacts'].values():
+        assert os.path.dirname(path) == str(tmp_path)
+        assert os.path.exists(path)
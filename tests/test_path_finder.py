@@ -0,0 +1,207 @@
+import heapq
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+try:
+    import pcbnew
+except ImportError:
+    import fake_pcbnew
+    sys.modules['pcbnew'] = fake_pcbnew
+
+import path_finder
+
+ENGINES = sorted(path_finder.ENGINES)
+
+
+def make_graph(seed: int, width: int = 60, height: int = 40, depth: int = 1) -> path_finder.Graph:
+    """Returns a graph with random rectangles and octagons of walls on each plane"""
+    rng = random.Random(seed)
+    graph = path_finder.Graph(width, height, depth)
+    for z in range(depth):
+        with graph.on_plane(z):
+            for _ in range(6):
+                (x, y) = (rng.randrange(width), rng.randrange(height))
+                graph.add_wall_rect(x, x + rng.randrange(2, 15), y, y + rng.randrange(2, 15))
+            for _ in range(10):
+                graph.add_wall_oct(rng.randrange(width), rng.randrange(height), rng.randrange(2, 7))
+    return graph
+
+
+def free_pairs(graph: path_finder.Graph, n: int, seed: int):
+    rng = random.Random(seed)
+    free = np.flatnonzero(~graph.walls.reshape(-1)).tolist()
+    return [(rng.choice(free), rng.choice(free)) for _ in range(n)]
+
+
+def dijkstra(graph: path_finder.Graph, src: int, dst: int) -> float:
+    """Cost of a shortest path from `src` to `dst`, by plain Dijkstra over `get_neighbors`"""
+    dist = {src: 0}
+    heap = [(0, src)]
+    while heap:
+        (d, cell) = heapq.heappop(heap)
+        if cell == dst:
+            return d
+        if d > dist[cell]:
+            continue
+        for next in graph.get_neighbors(cell):
+            nd = d + graph.cost(cell, next)
+            if nd < dist.get(next, float('inf')):
+                dist[next] = nd
+                heapq.heappush(heap, (nd, next))
+    return None
+
+
+def path_cost(graph: path_finder.Graph, path) -> float:
+    """Checks that `path` moves between neighbors without entering walls, and returns its cost"""
+    for (a, b) in zip(path, path[1:]):
+        assert b in graph.get_neighbors(a)
+    return sum(graph.cost(a, b) for a, b in zip(path, path[1:]))
+
+
+def find(graph: path_finder.Graph, src: int, dst: int, **kwargs):
+    graph.reset_nodes()
+    path = path_finder.find_path(graph, src, dst, **kwargs)
+    if not graph.reached(dst):
+        return None
+    assert (path[0], path[-1]) == (src, dst)
+    return path_cost(graph, path)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('seed', range(4))
+def test_engines_find_shortest_paths(engine, seed):
+    graph = make_graph(seed)
+    for (src, dst) in free_pairs(graph, 10, seed):
+        assert find(graph, src, dst, engine=engine) == dijkstra(graph, src, dst)
+
+
+@pytest.mark.parametrize('engine', ['astar', 'bidirectional', 'auto'])
+def test_engines_find_shortest_paths_through_vias(engine):
+    graph = make_graph(0, depth=2)
+    for (src, dst) in free_pairs(graph, 10, 0):
+        assert find(graph, src, dst, engine=engine) == dijkstra(graph, src, dst)
+
+
+def test_search_starts_and_ends_inside_walls():
+    graph = path_finder.Graph(20, 20)
+    graph.add_wall_rect(0, 4, 0, 4)
+    graph.add_wall_rect(15, 19, 15, 19)
+    (src, dst) = (graph.index(2, 2), graph.index(17, 17))
+    costs = {engine: find(graph, src, dst, engine=engine) for engine in ENGINES}
+    assert set(costs.values()) == {dijkstra(graph, src, dst)}
+
+
+@pytest.mark.parametrize('engine', ['astar', 'jps', 'bidirectional'])
+def test_unreachable_destination(engine):
+    graph = path_finder.Graph(20, 20)
+    graph.add_wall_rect(10, 10, 0, 19)
+    assert find(graph, graph.index(2, 2), graph.index(17, 17), engine=engine, margin=2) is None
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_margin_and_coarse_search_without_walls(engine):
+    graph = path_finder.Graph(80, 60)
+    for (src, dst) in free_pairs(graph, 10, 1):
+        cost = dijkstra(graph, src, dst)
+        assert find(graph, src, dst, engine=engine, margin=0) == cost
+        assert find(graph, src, dst, engine=engine, coarse=4) == cost
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_margin_and_coarse_search_with_walls(seed):
+    graph = make_graph(seed)
+    for (src, dst) in free_pairs(graph, 10, seed):
+        cost = dijkstra(graph, src, dst)
+        # A window covering the graph is the same as no window
+        assert find(graph, src, dst, margin=max(graph.width, graph.height)) == cost
+        # Smaller windows grow until a path is found, which may be longer
+        for kwargs in ({'margin': 2}, {'coarse': 4}, {'margin': 2, 'coarse': 4}):
+            found = find(graph, src, dst, **kwargs)
+            assert (found is None) == (cost is None)
+            assert cost is None or found >= cost
+
+
+def test_corridor_found_beforehand():
+    graph = make_graph(1)
+    for (src, dst) in free_pairs(graph, 10, 1):
+        expected = find(graph, src, dst, coarse=4)
+        corridor = path_finder.get_corridor(graph, src, dst, 4)
+        assert find(graph, src, dst, corridor=corridor) == expected
+
+
+def test_walls_are_reference_counted():
+    graph = path_finder.Graph(30, 30)
+    graph.add_wall_rect(5, 15, 5, 15)
+    graph.add_wall_oct(10, 10, 6)
+    graph.sub_wall_rect(5, 15, 5, 15)
+    expected = path_finder.Graph(30, 30)
+    expected.add_wall_oct(10, 10, 6)
+    assert (graph.walls == expected.walls).all()
+    graph.sub_wall_oct(10, 10, 6)
+    assert not graph.walls.any() and not graph.wall_count.any()
+
+
+def test_removing_missing_walls_keeps_later_walls():
+    graph = path_finder.Graph(30, 30)
+    graph.sub_wall_rect(5, 15, 5, 15)
+    assert graph.wall_count.min() == 0
+    graph.add_wall_rect(5, 15, 5, 15)
+    assert graph.walls[5:16, 5:16].all()
+
+
+def test_path_stamp_matches_diamonds():
+    graph = path_finder.Graph(200, 60)
+    expected = path_finder.Graph(200, 60)
+    path = [graph.index(x, 20 + (x // 3) % 20) for x in range(5, 195)]
+    graph.add_wall_path(path, 4, 3)
+    for cell in path:
+        expected.add_wall_diamond(*graph.coords(cell), 4, 3)
+    assert (graph.walls == expected.walls).all()
+    graph.sub_wall_path(path, 4, 3)
+    assert not graph.walls.any() and not graph.wall_count.any()
+
+
+def test_pad_stamp_and_open_pad():
+    graph = path_finder.Graph(30, 30)
+    pads = [(10, 10, 5, True), (20, 20, 6, False)]
+    for pad in pads:
+        graph.add_wall_pad(pad)
+    walls = graph.walls.copy()
+    graph.open_pad(pads[0])
+    assert not graph.walls[8:13, 8:13].any()
+    graph.close_pad(pads[0])
+    assert (graph.walls == walls).all()
+    for pad in pads:
+        graph.sub_wall_pad(pad)
+    assert not graph.walls.any() and not graph.wall_count.any()
+
+
+def test_wall_layers_undo_exactly():
+    graph = make_graph(2)
+    counts = graph.wall_count.copy()
+    with graph.wall_layer('layer'):
+        graph.add_wall_path([graph.index(x, 20) for x in range(60)], 2, 2)
+        graph.sub_wall_rect(0, 59, 0, 39)
+        graph.add_wall_rect(10, 20, 10, 20)
+    graph.add_wall_rect(30, 40, 5, 10)
+    graph.remove_wall_layer('layer')
+    graph.sub_wall_rect(30, 40, 5, 10)
+    assert (graph.wall_count == counts).all()
+    assert (graph.walls == (counts > 0)).all()
+
+
+def test_clear_wall_rect():
+    graph = path_finder.Graph(30, 30)
+    graph.add_wall_rect(0, 29, 0, 29)
+    graph.add_wall_rect(5, 10, 5, 10)
+    graph.clear_wall_rect(5, 10, 5, 10)
+    assert not graph.walls[5:11, 5:11].any() and not graph.wall_count[5:11, 5:11].any()
+    assert graph.walls.sum() == 30 * 30 - 36